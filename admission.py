@@ -0,0 +1,189 @@
+"""Process-wide admission control for new calls.
+
+Every live Realtime session reports the account's remaining request and
+token budget in `rate_limits.updated`. `RateLimits` keeps the latest of
+those figures; they are per account, so the newest event from any call
+is the current view, and a figure is assumed back at its limit once its
+`reset_seconds` have passed. `Admission` caps concurrent calls per
+process and decides, for each `/incoming-call`, whether the call is
+accepted or, when the process is full or a budget is nearly spent,
+what happens to it:
+
+* `queue`: the caller hears a hold message and Twilio asks again after
+  a pause, until there is room or `queue_timeout` runs out (then the
+  call is rejected);
+* `degrade`: while a rate-limit budget is low, the call is accepted
+  with a cheaper session configuration (a full process still turns
+  calls away, since a cheaper session takes the same slot);
+* `reject`: the caller hears a busy message and the call ends.
+
+Calls accepted by `/incoming-call` hold a slot until their media stream
+starts (or `RESERVATION_TTL` passes), so a burst of calls cannot all be
+admitted before the first one connects. With several worker processes
+the caller passes `room`, whether any worker has a free slot, and the
+workers keep those reservations themselves (see workers.py). It also
+passes the callers on hold at the other workers, so a caller whose hold
+redirect lands on another worker keeps their place and their queue
+timeout, and the first free slot on any worker goes to whoever has
+waited longest.
+
+A draining process (`draining` set before a deploy) turns new calls
+away whatever the policy, while its live calls carry on.
+"""
+import time
+
+import metrics
+
+ACCEPT = 'accept'
+QUEUE = 'queue'
+DEGRADE = 'degrade'
+REJECT = 'reject'
+POLICIES = (QUEUE, DEGRADE, REJECT)
+
+# Seconds an admitted call keeps its slot while Twilio opens its media stream
+RESERVATION_TTL = 15
+
+RATE_LIMIT_REMAINING = metrics.Gauge('relay_rate_limit_remaining',
+                                     'Remaining OpenAI budget from the latest rate_limits.updated.', ['name'])
+RATE_LIMIT_LIMIT = metrics.Gauge('relay_rate_limit_limit', 'OpenAI budget limit from rate_limits.updated.',
+                                 ['name'])
+ADMISSION_QUEUE = metrics.Gauge('relay_admission_queue_depth', 'Callers on hold waiting to be admitted.')
+ADMISSION_SLOTS = metrics.Gauge('relay_admission_calls', 'Calls holding an admission slot.')
+DECISIONS = metrics.Counter('relay_admission_decisions_total', 'Admission decisions for incoming calls.',
+                            ['decision', 'reason'])
+
+
+class RateLimits:
+    """Latest OpenAI rate-limit figures, shared by every call in the process."""
+
+    def __init__(self):
+        self._limits = {}  # name -> (limit, remaining, reset at)
+
+    def update(self, rate_limits, now=None):
+        """Record the `rate_limits` list of a `rate_limits.updated` event."""
+        now = time.monotonic() if now is None else now
+        for entry in rate_limits:
+            name = entry['name']
+            self._limits[name] = (entry['limit'], entry['remaining'], now + entry.get('reset_seconds', 0))
+            RATE_LIMIT_LIMIT.labels(name).set(entry['limit'])
+            RATE_LIMIT_REMAINING.labels(name).set(entry['remaining'])
+
+    def remaining(self, name, now=None):
+        """Remaining budget for `name`, or None if it has not been reported."""
+        limits = self._limits.get(name)
+        if limits is None:
+            return None
+        limit, remaining, reset_at = limits
+        now = time.monotonic() if now is None else now
+        return limit if now >= reset_at else remaining
+
+
+class Admission:
+    """Cap on concurrent calls and the policy for calls over it.
+
+    `max_calls` of 0 leaves the number of calls unlimited. A call is also
+    over the cap while fewer than `min_requests` requests or `min_tokens`
+    tokens remain in the account's budget.
+    """
+
+    def __init__(self, max_calls=0, policy=QUEUE, min_requests=0, min_tokens=0, queue_timeout=60,
+                 rate_limits=None):
+        if policy not in POLICIES:
+            raise ValueError(f"admission policy must be one of {', '.join(POLICIES)}, not {policy!r}")
+        self.max_calls = max_calls
+        self.policy = policy
+        self.min_requests = min_requests
+        self.min_tokens = min_tokens
+        self.queue_timeout = queue_timeout
+        self.rate_limits = rate_limits or RateLimits()
+        self.active = 0
+        self.draining = False
+        self._reservations = {}  # call id -> expiry of a slot whose stream has not started
+        self._waiting = {}       # call id -> (first seen, last seen) wall-clock times for callers on hold
+
+    def _expire(self, now):
+        for call_id in [c for c, expires in self._reservations.items() if expires <= now]:
+            del self._reservations[call_id]
+        # A caller that stops coming back has hung up (hold times are wall-clock, other workers share them)
+        wall = time.time()
+        for call_id in [c for c, (_, seen) in self._waiting.items() if wall - seen > RESERVATION_TTL]:
+            del self._waiting[call_id]
+        ADMISSION_SLOTS.set(self.active + len(self._reservations))
+        ADMISSION_QUEUE.set(len(self._waiting))
+
+    def over_budget(self, now=None, room=None):
+        """Why new calls can't be admitted right now, or None."""
+        if room is None:
+            if self.draining:
+                return 'draining'
+            if self.max_calls and self.active + len(self._reservations) >= self.max_calls:
+                return 'capacity'
+        elif not room:
+            return 'capacity'
+        requests = self.rate_limits.remaining('requests', now)
+        if self.min_requests and requests is not None and requests < self.min_requests:
+            return 'requests'
+        tokens = self.rate_limits.remaining('tokens', now)
+        if self.min_tokens and tokens is not None and tokens < self.min_tokens:
+            return 'tokens'
+        return None
+
+    def waiting(self):
+        """Callers on hold here: call id -> wall-clock time they were first put on hold."""
+        return {call_id: first_seen for call_id, (first_seen, _) in self._waiting.items()}
+
+    def admit(self, call_id, room=None, held=None, settled=()):
+        """Decide what happens to an incoming call: ACCEPT, or the policy for overflow calls.
+
+        `room` replaces this process's own cap when calls are spread over
+        several workers: whether one of them has a free slot. `held` maps
+        callers on hold at other workers to when they were first held, and
+        `settled` holds calls another worker has since admitted.
+        """
+        now = time.monotonic()
+        wall = time.time()
+        for other in settled:
+            self._waiting.pop(other, None)
+        self._expire(now)
+        queue = self.waiting()
+        for other, first_seen in (held or {}).items():
+            queue[other] = min(queue.get(other, first_seen), first_seen)
+        first_seen = queue.get(call_id, wall)
+        reason = self.over_budget(now, room)
+        # Callers who have waited longest get the first free slot; those past the timeout are turned away anyway
+        if reason is None and any(seen < first_seen and wall - seen < self.queue_timeout
+                                  for other, seen in queue.items() if other != call_id):
+            reason = 'queued'
+        if reason is None:
+            decision = ACCEPT
+        elif reason == 'draining':
+            decision = REJECT
+        elif self.policy == QUEUE:
+            decision = QUEUE if wall - first_seen < self.queue_timeout else REJECT
+        elif self.policy == DEGRADE and reason != 'capacity':
+            decision = DEGRADE
+        else:
+            decision = REJECT
+        if decision == QUEUE:
+            self._waiting[call_id] = (first_seen, wall)
+        else:
+            self._waiting.pop(call_id, None)
+        if decision in (ACCEPT, DEGRADE) and room is None:
+            self._reservations[call_id] = now + RESERVATION_TTL
+        DECISIONS.labels(decision, reason or 'ok').inc()
+        self._expire(now)
+        return decision
+
+    def call_started(self):
+        """A call's stream connected; it holds a slot until `call_ended`."""
+        self.active += 1
+        self._expire(time.monotonic())
+
+    def stream_started(self, call_id):
+        """The stream of admitted call `call_id` identified itself; release its reservation."""
+        self._reservations.pop(call_id, None)
+        self._expire(time.monotonic())
+
+    def call_ended(self):
+        self.active -= 1
+        self._expire(time.monotonic())
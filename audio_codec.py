@@ -0,0 +1,174 @@
+"""Table-driven G.711 codecs and streaming resampling on NumPy buffers.
+
+Shared by the Twilio (8 kHz mu-law) and browser (PCM16) paths. Every
+G.711 conversion is a single table lookup: decoding indexes a 256-entry
+table by the encoded byte, encoding indexes a 65536-entry table by the
+16-bit sample. `Resampler` converts between 8, 16 and 24 kHz (or any
+integer ratio) with a polyphase windowed-sinc filter and carries its
+filter history across chunks, so a stream can be converted frame by
+frame without clicks at chunk boundaries.
+"""
+from math import gcd
+
+import numpy as np
+
+# Realtime API audio formats: (encoding, sample rate).
+FORMATS = {
+    'g711_ulaw': ('ulaw', 8000),
+    'g711_alaw': ('alaw', 8000),
+    'pcm16': ('pcm16', 24000),
+}
+BYTES_PER_SAMPLE = {'ulaw': 1, 'alaw': 1, 'pcm16': 2}
+
+
+def _ulaw_decode_table():
+    ulaw = ~np.arange(256, dtype=np.uint8)
+    exponent = (ulaw >> 4) & 0x07
+    mantissa = (ulaw & 0x0F).astype(np.int32)
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(ulaw & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _alaw_decode_table():
+    alaw = np.arange(256, dtype=np.uint8) ^ 0x55
+    exponent = ((alaw >> 4) & 0x07).astype(np.int32)
+    mantissa = (alaw & 0x0F).astype(np.int32)
+    magnitude = np.where(exponent == 0, (mantissa << 4) + 8,
+                         ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0))
+    return np.where(alaw & 0x80, magnitude, -magnitude).astype(np.int16)
+
+
+def _all_samples():
+    """Every int16 value, ordered by its uint16 bit pattern (the encode table index)."""
+    return np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32)
+
+
+def _ulaw_encode_table():
+    pcm = _all_samples() >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    pcm = np.minimum(np.abs(pcm), 8159) + (0x84 >> 2)
+    segment = np.searchsorted([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF], pcm)
+    ulaw = (segment << 4) | ((pcm >> (segment + 1)) & 0x0F)
+    return (np.where(segment >= 8, 0x7F, ulaw) ^ mask).astype(np.uint8)
+
+
+def _alaw_encode_table():
+    pcm = _all_samples() >> 3
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    pcm = np.where(pcm >= 0, pcm, -pcm - 1)
+    segment = np.searchsorted([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF], pcm)
+    alaw = (segment << 4) | ((pcm >> np.where(segment < 2, 1, segment)) & 0x0F)
+    return (np.where(segment >= 8, 0x7F, alaw) ^ mask).astype(np.uint8)
+
+
+ULAW_TO_LINEAR = _ulaw_decode_table()
+ALAW_TO_LINEAR = _alaw_decode_table()
+LINEAR_TO_ULAW = _ulaw_encode_table()
+LINEAR_TO_ALAW = _alaw_encode_table()
+
+_DECODE_TABLES = {'ulaw': ULAW_TO_LINEAR, 'alaw': ALAW_TO_LINEAR}
+_ENCODE_TABLES = {'ulaw': LINEAR_TO_ULAW, 'alaw': LINEAR_TO_ALAW}
+
+
+def decode(audio, encoding):
+    """Decode raw `ulaw`, `alaw` or `pcm16` bytes to an int16 sample array."""
+    if encoding == 'pcm16':
+        return np.frombuffer(audio, dtype='<i2')
+    return _DECODE_TABLES[encoding][np.frombuffer(audio, dtype=np.uint8)]
+
+
+def encode(samples, encoding):
+    """Encode an int16 sample array to raw `ulaw`, `alaw` or `pcm16` bytes."""
+    samples = np.asarray(samples, dtype=np.int16)
+    if encoding == 'pcm16':
+        return samples.astype('<i2', copy=False).tobytes()
+    return _ENCODE_TABLES[encoding][samples.view(np.uint16)].tobytes()
+
+
+class Resampler:
+    """Streaming polyphase resampler between two integer sample rates.
+
+    Feed consecutive chunks of int16 samples to `process()`; the filter
+    history is kept between calls so the output is identical to
+    resampling the whole stream at once, delayed by half the filter
+    length (about 1 ms at the default `zero_crossings`).
+    """
+
+    def __init__(self, in_rate, out_rate, zero_crossings=8):
+        divisor = gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        if self.up == self.down:
+            return
+        # Low-pass at 90% of the lower Nyquist rate, designed at the upsampled rate.
+        taps_per_phase = 2 * zero_crossings * -(-self.down // self.up) + 1
+        length = taps_per_phase * self.up
+        cutoff = 0.45 * min(in_rate, out_rate) / (in_rate * self.up)
+        t = np.arange(length) - (length - 1) / 2
+        taps = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, 8.0) * self.up
+        # phases[p, k] weighs input sample i - k for output phase p
+        self.phases = taps.reshape(taps_per_phase, self.up).T.astype(np.float32)
+        self.taps_per_phase = taps_per_phase
+        self._history = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self._consumed = 0       # input samples seen so far
+        self._produced = 0       # output samples emitted so far
+        self._lookback = np.arange(taps_per_phase)
+
+    def process(self, samples):
+        """Resample the next chunk of int16 samples; returns int16 output samples."""
+        samples = np.asarray(samples, dtype=np.int16)
+        if self.up == self.down:
+            return samples
+        buffer = np.concatenate((self._history, samples.astype(np.float32)))
+        self._consumed += samples.size
+        # Output n reads input sample (n * down) // up, which must already have arrived.
+        end = -(-self._consumed * self.up // self.down)
+        n = np.arange(self._produced, end)
+        self._produced = end
+        position = (n * self.down) // self.up - (self._consumed - buffer.size)
+        windows = buffer[position[:, None] - self._lookback[None, :]]
+        output = np.einsum('nk,nk->n', windows, self.phases[(n * self.down) % self.up])
+        self._history = buffer[buffer.size - (self.taps_per_phase - 1):]
+        return np.clip(np.rint(output), -32768, 32767).astype(np.int16)
+
+
+class Transcoder:
+    """Stateful converter between two Realtime audio formats, e.g. pcm16 -> g711_ulaw.
+
+    Rates default to the Realtime API's rate for each format and can be
+    overridden for legs that use another rate (a 16 kHz browser
+    microphone, say).
+    """
+
+    def __init__(self, source, target, source_rate=None, target_rate=None):
+        self.source, default_source_rate = FORMATS[source]
+        self.target, default_target_rate = FORMATS[target]
+        self.resampler = Resampler(source_rate or default_source_rate,
+                                   target_rate or default_target_rate)
+
+    @property
+    def passthrough(self):
+        return self.source == self.target and self.resampler.up == self.resampler.down
+
+    def process(self, audio):
+        """Convert the next chunk of raw bytes."""
+        if self.passthrough:
+            return audio
+        return encode(self.resampler.process(decode(audio, self.source)), self.target)
+
+
+def realtime_format_for(encoding, rate):
+    """Pick the Realtime API format that needs the least work to feed a leg.
+
+    A leg already in a format the API speaks natively (8 kHz G.711 or
+    24 kHz PCM16) is relayed untouched. Anything else is converted to
+    PCM16, which only needs a resample rather than a resample plus a
+    lossy G.711 encode.
+    """
+    for name, native in FORMATS.items():
+        if native == (encoding, rate):
+            return name
+    return 'pcm16'
+
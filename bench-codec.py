@@ -0,0 +1,75 @@
+"""Benchmark of audio_codec.py: real-time factor per core for each conversion.
+
+Streams `--seconds` of synthetic speech-band audio through every codec
+and resampler in chunks of `--chunk-ms` (20 ms matches a Twilio frame)
+and reports how many times faster than real time one core runs, i.e.
+roughly how many concurrent streams of that conversion a core can
+carry.
+
+    python bench-codec.py [--seconds 60] [--chunk-ms 20]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import audio_codec
+
+
+def synthetic_audio(rate, seconds):
+    """A few harmonics plus noise, loud enough to exercise every G.711 segment."""
+    t = np.arange(int(rate * seconds)) / rate
+    audio = sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate((180, 360, 720, 1440, 2880)))
+    audio += np.random.default_rng(0).normal(scale=0.05, size=t.size)
+    return (audio / np.abs(audio).max() * 30000).astype(np.int16)
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def run(name, fn, inputs, seconds):
+    start = time.perf_counter()
+    for chunk in inputs:
+        fn(chunk)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<34} {seconds / elapsed:10.0f}x real time  {elapsed / len(inputs) * 1e6:8.1f} us/chunk")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--chunk-ms', type=int, default=20)
+    args = parser.parse_args()
+    seconds, chunk_ms = args.seconds, args.chunk_ms
+
+    print(f"Streaming {seconds:.0f}s of audio in {chunk_ms}ms chunks")
+    pcm8k = synthetic_audio(8000, seconds)
+    pcm24k = synthetic_audio(24000, seconds)
+    ulaw = audio_codec.encode(pcm8k, 'ulaw')
+    alaw = audio_codec.encode(pcm8k, 'alaw')
+
+    print("G.711")
+    run("ulaw decode (8 kHz)", lambda c: audio_codec.decode(c, 'ulaw'), chunks(ulaw, 8 * chunk_ms), seconds)
+    run("ulaw encode (8 kHz)", lambda c: audio_codec.encode(c, 'ulaw'), chunks(pcm8k, 8 * chunk_ms), seconds)
+    run("alaw decode (8 kHz)", lambda c: audio_codec.decode(c, 'alaw'), chunks(alaw, 8 * chunk_ms), seconds)
+    run("alaw encode (8 kHz)", lambda c: audio_codec.encode(c, 'alaw'), chunks(pcm8k, 8 * chunk_ms), seconds)
+
+    print("Resampling")
+    for in_rate, out_rate in ((8000, 16000), (8000, 24000), (16000, 24000),
+                              (24000, 16000), (24000, 8000), (16000, 8000)):
+        source = synthetic_audio(in_rate, seconds)
+        resampler = audio_codec.Resampler(in_rate, out_rate)
+        run(f"{in_rate // 1000} kHz -> {out_rate // 1000} kHz", resampler.process,
+            chunks(source, in_rate // 1000 * chunk_ms), seconds)
+
+    print("Transcoding between legs")
+    to_pcm = audio_codec.Transcoder('g711_ulaw', 'pcm16')
+    run("g711_ulaw 8 kHz -> pcm16 24 kHz", to_pcm.process, chunks(ulaw, 8 * chunk_ms), seconds)
+    to_ulaw = audio_codec.Transcoder('pcm16', 'g711_ulaw')
+    run("pcm16 24 kHz -> g711_ulaw 8 kHz", to_ulaw.process,
+        chunks(audio_codec.encode(pcm24k, 'pcm16'), 48 * chunk_ms), seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Micro-benchmarks of the per-frame cost of the audio relay.
+
+Outbound: compares the original path (json.loads, base64 round trip, dict
+rebuild, json.dumps) against the fast path in relay.py on realistic
+`response.audio.delta` events.
+
+Inbound: measures the CPU cost (including WebSocket framing and the
+socket write) and send rate of turning Twilio media frames into
+`input_audio_buffer.append` events for several coalescing windows,
+against the latency each window adds to caller audio.
+
+    python bench-relay.py [--frames 20000] [--delta-ms 100] [--windows 0,20,60,100,200]
+"""
+import argparse
+import base64
+import json
+import os
+import socket
+import threading
+import time
+
+from websockets.frames import Frame, Opcode
+
+import relay
+
+STREAM_SID = 'MZ00000000000000000000000000000000'
+
+
+def make_event(delta_ms):
+    """Build a `response.audio.delta` event carrying `delta_ms` of g711_ulaw."""
+    audio = os.urandom(8 * delta_ms)  # 8 kHz, one byte per sample
+    return json.dumps({
+        "type": "response.audio.delta",
+        "event_id": "event_AbCdEfGhIjKlMnOp",
+        "response_id": "resp_AbCdEfGhIjKlMnOp",
+        "item_id": "item_AbCdEfGhIjKlMnOp",
+        "output_index": 0,
+        "content_index": 0,
+        "delta": base64.b64encode(audio).decode('utf-8'),
+    })
+
+
+def legacy_frame(message):
+    """The relay as originally written in send_to_twilio."""
+    response = json.loads(message)
+    if response.get('type') == 'response.audio.delta' and 'delta' in response:
+        audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
+        audio_delta = {
+            "event": "media",
+            "streamSid": STREAM_SID,
+            "media": {
+                "payload": audio_payload
+            }
+        }
+        # Starlette's send_json serializes with json.dumps
+        return json.dumps(audio_delta, separators=(",", ":"), ensure_ascii=False)
+
+
+def fast_frame(message, prefix=relay.media_frame_prefix(STREAM_SID)):
+    """The relay fast path used by send_to_twilio."""
+    if relay.event_type(message) == relay.AUDIO_DELTA:
+        fields = relay.split_audio_delta(message)
+        if fields is not None:
+            return relay.media_frame(prefix, fields[1])
+
+
+def twilio_frame(chunk):
+    """Build a Twilio media event carrying 20 ms of mu-law audio."""
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": str(chunk + 2),
+        "streamSid": STREAM_SID,
+        "media": {
+            "track": "inbound",
+            "chunk": str(chunk + 1),
+            "timestamp": str(chunk * 20),
+            "payload": base64.b64encode(os.urandom(160)).decode('utf-8'),
+        },
+    })
+
+
+def bench_inbound(window_ms, messages, seconds):
+    """Return (us of CPU per second of audio, appends per second, mean and max added ms)."""
+    sender, receiver = socket.socketpair()
+    drain = threading.Thread(target=lambda: [None for _ in iter(lambda: receiver.recv(1 << 16), b'')])
+    drain.start()
+    coalescer = relay.AudioCoalescer(window_ms)
+    sent = 0
+    delays = []
+    pending = []
+    start = time.perf_counter()
+    for frame in range(seconds * len(messages)):
+        data = relay.loads(messages[frame % len(messages)])
+        pending.append(frame)
+        batch = coalescer.add(data['media']['payload'], frame)
+        if batch is not None:
+            message = relay.audio_append_message(batch[0])
+            # Client frames to OpenAI are masked, as websockets does on the real socket
+            sender.sendall(Frame(Opcode.TEXT, message.encode('utf-8')).serialize(mask=True))
+            sent += 1
+            # Frames arrive every 20 ms, so a frame waits 20 ms per frame that followed it
+            delays.extend((frame - queued) * 20 for queued in pending)
+            pending.clear()
+    elapsed = time.perf_counter() - start
+    sender.close()
+    drain.join()
+    receiver.close()
+    return elapsed / seconds * 1e6, sent / seconds, sum(delays) / len(delays), max(delays)
+
+
+def bench(fn, message, frames):
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn(message)
+    return (time.perf_counter() - start) / frames * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--delta-ms', type=int, default=100,
+                        help='audio per delta event in milliseconds')
+    parser.add_argument('--windows', default='0,20,40,60,100,200',
+                        help='inbound coalescing windows to compare, in milliseconds')
+    args = parser.parse_args()
+
+    message = make_event(args.delta_ms)
+    assert json.loads(legacy_frame(message)) == json.loads(fast_frame(message))
+
+    codec = 'orjson' if relay.orjson is not None else 'json'
+    print(f"Relaying {args.frames} deltas of {args.delta_ms}ms ({len(message)} bytes), codec: {codec}")
+    legacy = bench(legacy_frame, message, args.frames)
+    fast = bench(fast_frame, message, args.frames)
+    print(f"  legacy:    {legacy:8.2f} us/frame")
+    print(f"  fast path: {fast:8.2f} us/frame")
+    print(f"  speedup:   {legacy / fast:8.1f}x")
+
+    # One second of Twilio frames, replayed until roughly --frames frames have been relayed
+    frames = [twilio_frame(chunk) for chunk in range(50)]
+    seconds = max(1, args.frames // 50)
+    print(f"\nCoalescing {seconds}s of caller audio into input_audio_buffer.append events")
+    print("  window  us/s audio  appends/s  added latency mean/max")
+    for window_ms in (int(w) for w in args.windows.split(',')):
+        cpu, rate, mean_delay, max_delay = bench_inbound(window_ms, frames, seconds)
+        print(f"  {window_ms:4d}ms  {cpu:10.1f}  {rate:9.1f}  {mean_delay:7.1f}ms / {max_delay:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
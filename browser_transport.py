@@ -0,0 +1,59 @@
+"""Wire formats for the /browser-stream WebSocket.
+
+JSON mode (the default, and what older pages speak) carries audio both
+ways as text frames: `{"type": "audio", "audio": <base64 PCM16>}`.
+
+Binary mode is requested with `?transport=binary`. Audio then travels as
+binary WebSocket messages of raw little-endian PCM16 behind a 4-byte
+header, and anything else (control events) stays JSON text. The server
+confirms the mode with a text message
+`{"type": "transport", "transport": "binary", "sample_rate": <rate>}`
+before any audio. Base64 is then only used at the OpenAI boundary, which
+saves a third of the browser bandwidth and an encode/decode per chunk on
+both ends.
+
+Header (`HEADER`, little-endian):
+    kind      uint8   1 = audio
+    version   uint8   1
+    sequence  uint16  per-direction frame counter, wrapping at 65536
+The server numbers frames as it queues them, so a gap in the sequence a
+page receives means the server dropped audio because the page fell
+behind.
+"""
+import struct
+
+JSON = 'json'
+BINARY = 'binary'
+TRANSPORTS = (JSON, BINARY)
+
+HEADER = struct.Struct('<BBH')
+AUDIO = 1
+VERSION = 1
+
+
+def audio_frame(audio, sequence):
+    """Binary message carrying raw PCM16 `audio`."""
+    return HEADER.pack(AUDIO, VERSION, sequence & 0xFFFF) + audio
+
+
+def parse_frame(message):
+    """Split a binary message into `(kind, sequence, payload)`.
+
+    Raises ValueError for a message too short to hold a header or from an
+    unknown protocol version.
+    """
+    if len(message) < HEADER.size:
+        raise ValueError(f"binary message of {len(message)} bytes has no header")
+    kind, version, sequence = HEADER.unpack_from(message)
+    if version != VERSION:
+        raise ValueError(f"unsupported binary frame version {version}")
+    return kind, sequence, message[HEADER.size:]
+
+
+def json_audio_message(payload):
+    """JSON-mode text message for a base64 `payload` (base64 never needs escaping)."""
+    return '{"type":"audio","audio":"' + payload + '"}'
+
+
+def transport_message(transport, sample_rate):
+    return '{"type":"transport","transport":"%s","sample_rate":%d}' % (transport, sample_rate)
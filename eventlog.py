@@ -0,0 +1,258 @@
+"""Non-blocking, sampled logging for the relay.
+
+Records are handed to a background thread through a bounded queue
+(`logging.handlers.QueueHandler`/`QueueListener`), so a slow stdout never
+stalls the event loop; if the queue is full the record is dropped and
+counted instead. Formatting happens on that thread too: messages use
+%-style arguments, and expensive ones can be wrapped in `lazy()`, so a
+payload is only serialized if its record is actually written.
+
+Every record carries an event name (e.g. `browser.audio_in`). Before a
+record is even built, `Sampler` applies the rule for its event: keep
+every Nth record (`0.01` keeps 1 in 100) or at most N per second
+(`20/s`). The next record of an event that gets through says how many
+were skipped. `CallLog` attaches the call's transport, call id and
+stream SID to each of its records.
+
+Configured with LOG_LEVEL (default INFO), LOG_FORMAT (`text` or `json`),
+LOG_SAMPLING (comma-separated `event=rule` overrides, `*` for the
+default rule) and LOG_QUEUE_SIZE (default 10000).
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import uuid
+
+import metrics
+
+logger = logging.getLogger('relay')
+
+LOG_DROPPED = metrics.Counter('relay_log_dropped_total',
+                              'Log records dropped because the log writer fell behind.')
+
+# Hot-path events are sampled by default; everything else is kept.
+DEFAULT_RULES = {
+    'browser.audio_in': '0.01',
+    'browser.audio_out': '0.01',
+    'browser.openai_event': '20/s',
+    'twilio.openai_event': '50/s',
+}
+
+_CONTEXT_FIELDS = ('event', 'transport', 'call_id', 'stream_sid', 'suppressed')
+
+
+class lazy:
+    """Defer an expensive call until the record is formatted, e.g. `lazy(json.dumps, payload)`."""
+    __slots__ = ('fn', 'args')
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+
+class _Rule:
+    """Keep every `every`th record, or at most `per_second` records per second."""
+    __slots__ = ('every', 'per_second', 'seen', 'tokens', 'refilled_at', 'suppressed')
+
+    def __init__(self, spec):
+        self.every = 1
+        self.per_second = None
+        if spec.endswith('/s'):
+            self.per_second = float(spec[:-2])
+            self.tokens = self.per_second
+            self.refilled_at = time.monotonic()
+        else:
+            fraction = float(spec)
+            self.every = max(1, round(1 / fraction)) if fraction > 0 else 0
+        self.seen = 0
+        self.suppressed = 0
+
+    def allow(self):
+        if self.per_second is not None:
+            now = time.monotonic()
+            self.tokens = min(self.per_second, self.tokens + (now - self.refilled_at) * self.per_second)
+            self.refilled_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+        elif self.every:
+            self.seen += 1
+            if self.seen % self.every == 1 or self.every == 1:
+                return True
+        self.suppressed += 1
+        return False
+
+
+class Sampler:
+    """Per-event sampling and rate limits, shared by every call."""
+
+    def __init__(self, rules):
+        self.default = rules.get('*')
+        self.specs = rules
+        self.rules = {}
+
+    def allow(self, event):
+        """Return None to skip the record, else how many were skipped since the last one."""
+        rule = self.rules.get(event)
+        if rule is None:
+            spec = self.specs.get(event, self.default)
+            if spec is None:
+                return 0
+            rule = self.rules[event] = _Rule(spec)
+        if not rule.allow():
+            return None
+        suppressed, rule.suppressed = rule.suppressed, 0
+        return suppressed
+
+
+def parse_rules(text):
+    """Parse LOG_SAMPLING, e.g. 'browser.audio_in=0.001,twilio.openai_event=10/s'."""
+    rules = {}
+    for entry in filter(None, (part.strip() for part in text.split(','))):
+        event, _, spec = entry.partition('=')
+        rules[event.strip()] = spec.strip()
+    return rules
+
+
+sampler = Sampler(DEFAULT_RULES)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue records as they are; drop them rather than block when the queue is full."""
+
+    def prepare(self, record):
+        # Same process, so the record can cross threads unformatted
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room rather than fail when stopping with a full queue
+        self.queue.put(self._sentinel)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{self.formatTime(record)} {record.levelname} {record.getMessage()}"
+        context = ' '.join(f"{field}={getattr(record, field)}" for field in _CONTEXT_FIELDS
+                           if getattr(record, field, None))
+        if context:
+            line = f"{line} [{context}]"
+        if record.exc_info:
+            line = f"{line}\n{self.formatException(record.exc_info)}"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'message': record.getMessage()}
+        for field in _CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+_listener = None
+
+
+def setup():
+    """Route the `relay` logger through a background writer thread; safe to call twice."""
+    global _listener, sampler
+    if _listener is not None:
+        return
+    rules = dict(DEFAULT_RULES)
+    rules.update(parse_rules(os.getenv('LOG_SAMPLING', '')))
+    sampler = Sampler(rules)
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if os.getenv('LOG_FORMAT') == 'json' else TextFormatter())
+    records = queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', 10000)))
+    logger.addHandler(_DroppingQueueHandler(records))
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+    _listener = _Listener(records, output)
+    _listener.start()
+
+
+def shutdown():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _emit(level, event, msg, args, exc_info, context):
+    suppressed = sampler.allow(event)
+    if suppressed is None:
+        return
+    context['event'] = event
+    context['suppressed'] = suppressed
+    logger.log(level, msg, *args, exc_info=exc_info, extra=context)
+
+
+def log(level, event, msg, *args, exc_info=None, **context):
+    """Log one record for `event` unless its level is disabled or the sampler skips it."""
+    if logger.isEnabledFor(level):
+        _emit(level, event, msg, args, exc_info, context)
+
+
+class CallLog:
+    """Logger for one call: every record carries the call's transport, id and stream SID.
+
+    The level check comes first, so a disabled per-chunk record costs one
+    method call and a cached lookup.
+    """
+
+    def __init__(self, transport, call_id=None):
+        self.transport = transport
+        self.call_id = call_id or uuid.uuid4().hex[:12]
+        self.stream_sid = None
+
+    def log(self, level, event, msg, *args, exc_info=None):
+        if logger.isEnabledFor(level):
+            _emit(level, event, msg, args, exc_info, {
+                'transport': self.transport, 'call_id': self.call_id, 'stream_sid': self.stream_sid})
+
+    def debug(self, event, msg, *args):
+        if logger.isEnabledFor(logging.DEBUG):
+            self.log(logging.DEBUG, event, msg, *args)
+
+    def info(self, event, msg, *args):
+        self.log(logging.INFO, event, msg, *args)
+
+    def warning(self, event, msg, *args):
+        self.log(logging.WARNING, event, msg, *args)
+
+    def error(self, event, msg, *args, exc_info=None):
+        self.log(logging.ERROR, event, msg, *args, exc_info=exc_info)
+
+def debug(event, msg, *args, **context):
+    log(logging.DEBUG, event, msg, *args, **context)
+
+
+def info(event, msg, *args, **context):
+    log(logging.INFO, event, msg, *args, **context)
+
+
+def warning(event, msg, *args, **context):
+    log(logging.WARNING, event, msg, *args, **context)
+
+
+def error(event, msg, *args, exc_info=None, **context):
+    log(logging.ERROR, event, msg, *args, exc_info=exc_info, **context)
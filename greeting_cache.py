@@ -0,0 +1,124 @@
+"""Cache of the synthesized greeting audio, keyed by voice, text and format.
+
+The greeting is the same on every call, so instead of asking the model
+to speak it each time the first call records the audio of the greeting
+response and later calls stream that audio straight from memory. The
+cache key covers the voice, greeting text and audio format, so changing
+any of them misses the old entry and records a new one. Entries can be
+persisted to a directory so restarts don't have to record again; they
+are read back once at startup (`preload`), never on the call path.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+
+# Audio bytes per millisecond of each Realtime output format.
+BYTES_PER_MS = {
+    'g711_ulaw': 8,
+    'g711_alaw': 8,
+    'pcm16': 48,
+}
+# Cached audio is replayed in chunks of this many milliseconds.
+CHUNK_MS = 100
+
+
+def cache_key(voice, text, audio_format):
+    digest = hashlib.sha256('\0'.join((voice, audio_format, text)).encode('utf-8'))
+    return digest.hexdigest()[:24]
+
+
+class Greeting:
+    """A recorded greeting: its transcript and base64 audio chunks ready to send."""
+
+    def __init__(self, audio, transcript, audio_format):
+        self.audio = audio
+        self.transcript = transcript
+        self.audio_format = audio_format
+        size = BYTES_PER_MS[audio_format] * CHUNK_MS
+        self.chunks = [base64.b64encode(audio[i:i + size]).decode('ascii')
+                       for i in range(0, len(audio), size)]
+
+
+class GreetingRecording:
+    """Collects the audio of one greeting response as it streams past."""
+
+    def __init__(self, cache, voice, text, audio_format):
+        self.cache = cache
+        self.key = cache_key(voice, text, audio_format)
+        self.audio_format = audio_format
+        self.metadata = {"voice": voice, "text": text, "format": audio_format}
+        self.transcript = None
+        self.audio = bytearray()
+
+    def add(self, delta):
+        self.audio += base64.b64decode(delta)
+
+    async def finish(self, status):
+        """Store the recording if the greeting response completed uninterrupted."""
+        if status != 'completed' or not self.audio or not self.transcript:
+            return None
+        greeting = Greeting(bytes(self.audio), self.transcript, self.audio_format)
+        await self.cache.put(self.key, greeting, self.metadata)
+        return greeting
+
+
+class GreetingCache:
+    """In-memory greeting cache, optionally backed by `directory`."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._entries = {}
+
+    def get(self, voice, text, audio_format):
+        """Return the cached `Greeting`, or None if it has not been recorded yet."""
+        return self._entries.get(cache_key(voice, text, audio_format))
+
+    def preload(self):
+        """Load every greeting persisted in `directory`; blocking, so run it off the event loop."""
+        if not self.directory:
+            return
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            key, extension = os.path.splitext(name)
+            if extension == '.json' and key not in self._entries:
+                greeting = self._load(key)
+                if greeting is not None:
+                    self._entries[key] = greeting
+
+    def record(self, voice, text, audio_format):
+        """Start recording a greeting for a cache miss."""
+        return GreetingRecording(self, voice, text, audio_format)
+
+    async def put(self, key, greeting, metadata):
+        self._entries[key] = greeting
+        if self.directory:
+            await asyncio.to_thread(self._save, key, greeting, metadata)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.json', base + '.audio'
+
+    def _load(self, key):
+        meta_path, audio_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                metadata = json.load(f)
+            with open(audio_path, 'rb') as f:
+                audio = f.read()
+        except (OSError, ValueError):
+            return None
+        return Greeting(audio, metadata['transcript'], metadata['format'])
+
+    def _save(self, key, greeting, metadata):
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path, audio_path = self._paths(key)
+        with open(audio_path, 'wb') as f:
+            f.write(greeting.audio)
+        # Metadata is written last so a reader never sees it without the audio.
+        with open(meta_path, 'w') as f:
+            json.dump(dict(metadata, transcript=greeting.transcript), f)
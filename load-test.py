@@ -0,0 +1,532 @@
+"""Load generator that simulates concurrent Twilio callers against main.py.
+
+Each simulated call connects to `/media-stream`, sends the Twilio
+`connected`/`start` events and then one 20 ms mu-law media frame every
+20 ms, acknowledging `mark` events as the audio would have finished
+playing and dropping buffered audio on `clear`. With `--transport json`
+or `--transport binary` the calls are browser pages on `/browser-stream`
+streaming 24 kHz PCM16 in that wire format instead, to compare the
+bandwidth and server CPU of the two. Run it against a server whose OPENAI_REALTIME_URL points at
+mock_realtime.py (or pass --spawn to start both) to find the concurrency
+ceiling of one process without touching the real API.
+
+    python load-test.py --spawn --calls 200 --concurrency 50 --duration 20
+    python load-test.py --spawn --transport binary
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+import uuid
+import xml.etree.ElementTree as ElementTree
+from collections import deque
+from urllib.parse import urlencode, urljoin, urlparse
+
+import websockets
+
+import browser_transport
+from mock_realtime import TIMESTAMP, read_timestamp, read_turn_end
+
+FRAME_MS = 20
+FRAME_BYTES = 160  # 20 ms of 8 kHz mu-law
+BROWSER_FRAME_BYTES = 960  # 20 ms of 24 kHz PCM16
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def process_stats(pid):
+    """Return (cpu_seconds, rss_bytes) for `pid` and its child processes (workers) from /proc, or None."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/status') as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+    except (OSError, StopIteration):
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss = rss_kb * 1024
+    for child in child_pids(pid):
+        stats = process_stats(child)
+        if stats:
+            cpu += stats[0]
+            rss += stats[1]
+    return cpu, rss
+
+
+def child_pids(pid):
+    children = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == pid:
+                children.append(int(name))
+    return children
+
+
+def server_metrics(url, prefix):
+    """Sum the server's /metrics samples starting with `prefix`, by name and labels."""
+    try:
+        with urllib.request.urlopen(http_url(url, '/metrics'), timeout=5) as response:
+            text = response.read().decode('utf-8')
+    except OSError:
+        return {}
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            name, _, value = line.rpartition(' ')
+            samples[name] = samples.get(name, 0) + float(value)
+    return samples
+
+
+def worker_urls(args):
+    """The server URL of each spawned worker (they listen on consecutive ports)."""
+    parsed = urlparse(args.url)
+    return [parsed._replace(netloc=f'{parsed.hostname}:{parsed.port + worker}').geturl()
+            for worker in range(args.workers if args.spawn else 1)] if parsed.port else [args.url]
+
+
+def http_url(url, path):
+    """The http(s) URL of `path` on the server behind WebSocket `url`."""
+    parsed = urlparse(url)
+    return f"{'https' if parsed.scheme == 'wss' else 'http'}://{parsed.netloc}{path}"
+
+
+def post_form(url, fields):
+    request = urllib.request.Request(url, data=urlencode(fields).encode('ascii'), method='POST')
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.read().decode('utf-8')
+
+
+def metric_total(samples, name, label=''):
+    """Sum the samples of metric `name` whose labels include `label`."""
+    return sum(value for sample, value in samples.items()
+               if sample.partition('{')[0] == name and label in sample)
+
+
+async def frame_schedule(duration):
+    """Yield frame indices every FRAME_MS on a drift-free schedule."""
+    start = time.perf_counter()
+    for chunk in range(int(duration * 1000 / FRAME_MS)):
+        yield chunk
+        delay = start + (chunk + 1) * FRAME_MS / 1000 - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class TurnedAway(Exception):
+    """/incoming-call did not connect the call."""
+
+
+class Results:
+    def __init__(self):
+        self.relay_latencies = []
+        self.playback_leads = []
+        self.unplayed_at_clear = []
+        self.turn_latencies = []  # (minute of the call, end of caller turn to first answer audio)
+        self.hold_times = []
+        self.rejected = 0
+        self.degraded = 0
+        self.streams = {}  # stream host:port -> calls connected to it
+        self.first_audio = []
+        self.setup_times = []
+        self.completed = 0
+        self.failed = 0
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class TwilioCaller:
+    """One simulated Twilio Media Stream.
+
+    With `dial`, the call first goes through `/incoming-call` as Twilio
+    would: it waits out hold redirects and connects to the stream URL and
+    parameters from the TwiML, or ends if the server turns it away.
+    """
+
+    def __init__(self, url, duration, results, dial=False):
+        self.url = url
+        self.duration = duration
+        self.results = results
+        self.dial = dial
+        self.call_sid = 'CA' + uuid.uuid4().hex
+        self.parameters = {}
+        self.stream_sid = 'MZ' + uuid.uuid4().hex
+        self.playback_end = 0.0
+        self.pending_marks = deque()
+        self.last_turn_end = None
+
+    async def incoming_call(self):
+        """Follow /incoming-call's TwiML; returns the stream URL, or None if the call was turned away."""
+        url = http_url(self.url, '/incoming-call')
+        started = time.perf_counter()
+        while True:
+            twiml = ElementTree.fromstring(await asyncio.to_thread(
+                post_form, url, {'CallSid': self.call_sid, 'From': '+15550100', 'To': '+15550199'}))
+            stream = twiml.find('./Connect/Stream')
+            if stream is not None:
+                self.results.hold_times.append(time.perf_counter() - started)
+                self.parameters = {p.get('name'): p.get('value') for p in stream.findall('Parameter')}
+                return self.stream_url(stream.get('url'))
+            redirect = twiml.find('Redirect')
+            if redirect is None:
+                return None
+            pause = twiml.find('Pause')
+            await asyncio.sleep(int(pause.get('length', 1)) if pause is not None else 1)
+            url = urljoin(url, redirect.text)
+
+    def stream_url(self, url):
+        """Reach a TwiML stream URL the way the load test reaches the server (ws, same port if none)."""
+        parsed = urlparse(url)
+        base = urlparse(self.url)
+        netloc = parsed.netloc if parsed.port else base.netloc
+        return parsed._replace(scheme=base.scheme, netloc=netloc).geturl()
+
+    async def run(self):
+        url = self.url
+        if self.dial:
+            url = await self.incoming_call()
+            if url is None:
+                raise TurnedAway()
+            netloc = urlparse(url).netloc
+            self.results.streams[netloc] = self.results.streams.get(netloc, 0) + 1
+            if self.parameters.get('degraded') == 'true':
+                self.results.degraded += 1
+        started = time.perf_counter()
+        async with websockets.connect(url, max_size=None) as ws:
+            self.results.setup_times.append(time.perf_counter() - started)
+            self.connected_at = time.perf_counter()
+            self.connected_wall = time.time()
+            self.first_audio = None
+            await self.send(ws, {"event": "connected", "protocol": "Call", "version": "1.0.0"})
+            await self.send(ws, {
+                "event": "start", "sequenceNumber": "1", "streamSid": self.stream_sid,
+                "start": {
+                    "streamSid": self.stream_sid, "callSid": self.call_sid,
+                    "accountSid": 'AC' + uuid.uuid4().hex, "tracks": ["inbound"],
+                    "customParameters": self.parameters,
+                    "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1},
+                },
+            })
+            receiver = asyncio.create_task(self.receive(ws))
+            try:
+                await self.stream_audio(ws)
+                await self.send(ws, {"event": "stop", "streamSid": self.stream_sid,
+                                     "stop": {"callSid": "", "accountSid": ""}})
+            finally:
+                receiver.cancel()
+                for handle, _ in self.pending_marks:
+                    handle.cancel()
+        if self.first_audio is not None:
+            self.results.first_audio.append(self.first_audio)
+
+    async def send(self, ws, event):
+        message = json.dumps(event)
+        self.results.bytes_sent += len(message)
+        await ws.send(message)
+
+    async def stream_audio(self, ws):
+        """Send one media frame every 20 ms."""
+        payload = base64.b64encode(b'\xff' * FRAME_BYTES).decode('ascii')
+        async for chunk in frame_schedule(self.duration):
+            await self.send(ws, {
+                "event": "media", "sequenceNumber": str(chunk + 2), "streamSid": self.stream_sid,
+                "media": {"track": "inbound", "chunk": str(chunk + 1),
+                          "timestamp": str(chunk * FRAME_MS), "payload": payload},
+            })
+            self.results.frames_sent += 1
+
+    async def receive(self, ws):
+        loop = asyncio.get_running_loop()
+        async for message in ws:
+            self.results.bytes_received += len(message)
+            data = json.loads(message)
+            event = data.get('event')
+            if event == 'media':
+                audio = base64.b64decode(data['media']['payload'])
+                now = time.time()
+                self.results.frames_received += 1
+                lead = max(0.0, self.playback_end - loop.time())
+                self.results.playback_leads.append(lead)
+                # Audio stamped before this call started was replayed from a cache, not relayed.
+                # Audio queued behind playback may have been paced on purpose, so relay latency
+                # only counts frames that start playback.
+                if len(audio) >= TIMESTAMP.size and read_timestamp(audio) >= self.connected_wall:
+                    if lead == 0:
+                        self.results.relay_latencies.append(now - read_timestamp(audio))
+                    turn_end = read_turn_end(audio)
+                    if turn_end != self.last_turn_end:
+                        # First audio of the answer to a new caller turn
+                        self.last_turn_end = turn_end
+                        self.results.turn_latencies.append((max(0, int((turn_end - self.connected_wall) // 60)),
+                                                            now - turn_end))
+                if self.first_audio is None:
+                    self.first_audio = time.perf_counter() - self.connected_at
+                # Twilio plays audio at 8 bytes/ms, queued behind what is already playing
+                self.playback_end = loop.time() + lead + len(audio) / 8000
+            elif event == 'mark':
+                handle = loop.call_at(self.playback_end, self.ack_mark, ws)
+                self.pending_marks.append((handle, data['mark']))
+            elif event == 'clear':
+                # Twilio drops buffered audio and returns every pending mark at once
+                self.results.unplayed_at_clear.append(max(0.0, self.playback_end - loop.time()))
+                self.playback_end = loop.time()
+                while self.pending_marks:
+                    handle, _ = self.pending_marks[0]
+                    handle.cancel()
+                    self.ack_mark(ws)
+
+    def ack_mark(self, ws):
+        _, mark = self.pending_marks.popleft()
+        if ws.open:
+            asyncio.ensure_future(self.send(ws, {"event": "mark", "streamSid": self.stream_sid, "mark": mark}))
+
+
+class BrowserCaller:
+    """One simulated page on /browser-stream, speaking the JSON or binary wire format."""
+
+    def __init__(self, url, duration, results, transport=browser_transport.JSON):
+        self.url = url
+        self.duration = duration
+        self.results = results
+        self.binary = transport == browser_transport.BINARY
+
+    async def run(self):
+        started = time.perf_counter()
+        url = self.url + ('?transport=binary' if self.binary else '')
+        async with websockets.connect(url, max_size=None) as ws:
+            self.results.setup_times.append(time.perf_counter() - started)
+            self.connected_at = time.perf_counter()
+            self.connected_wall = time.time()
+            self.first_audio = None
+            receiver = asyncio.create_task(self.receive(ws))
+            try:
+                await self.stream_audio(ws)
+            finally:
+                receiver.cancel()
+        if self.first_audio is not None:
+            self.results.first_audio.append(self.first_audio)
+
+    async def stream_audio(self, ws):
+        """Send 20 ms of silence every 20 ms."""
+        audio = b'\x00' * BROWSER_FRAME_BYTES
+        payload = base64.b64encode(audio).decode('ascii')
+        async for chunk in frame_schedule(self.duration):
+            if self.binary:
+                message = browser_transport.audio_frame(audio, chunk)
+            else:
+                message = browser_transport.json_audio_message(payload)
+            self.results.bytes_sent += len(message)
+            await ws.send(message)
+            self.results.frames_sent += 1
+
+    async def receive(self, ws):
+        async for message in ws:
+            self.results.bytes_received += len(message)
+            if isinstance(message, bytes):
+                _, _, audio = browser_transport.parse_frame(message)
+            else:
+                data = json.loads(message)
+                if data.get('type') != 'audio':
+                    continue
+                audio = base64.b64decode(data['audio'])
+            now = time.time()
+            self.results.frames_received += 1
+            if len(audio) >= TIMESTAMP.size and read_timestamp(audio) >= self.connected_wall:
+                self.results.relay_latencies.append(now - read_timestamp(audio))
+            if self.first_audio is None:
+                self.first_audio = time.perf_counter() - self.connected_at
+
+
+async def run_load(args, server_pid=None):
+    results = Results()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    peak_rss = 0
+    stats_before = process_stats(server_pid) if server_pid else None
+
+    async def one_call(index):
+        async with semaphore:
+            try:
+                if args.transport == 'twilio':
+                    await TwilioCaller(args.url, args.duration, results, args.incoming_call).run()
+                else:
+                    await BrowserCaller(args.url, args.duration, results, args.transport).run()
+                results.completed += 1
+            except TurnedAway:
+                results.rejected += 1
+            except Exception as e:
+                results.failed += 1
+                if results.failed <= 5:
+                    print(f"Call {index} failed: {e!r}")
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            stats = process_stats(server_pid)
+            if stats:
+                peak_rss = max(peak_rss, stats[1])
+            await asyncio.sleep(0.5)
+
+    sampler = asyncio.create_task(sample_rss()) if server_pid else None
+    started = time.perf_counter()
+    calls = []
+    for index in range(args.calls):
+        calls.append(asyncio.create_task(one_call(index)))
+        if args.ramp:
+            await asyncio.sleep(1 / args.ramp)
+    await asyncio.gather(*calls)
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.cancel()
+
+    latencies_ms = [latency * 1000 for latency in results.relay_latencies]
+    leads_ms = [lead * 1000 for lead in results.playback_leads]
+    unplayed_ms = [unplayed * 1000 for unplayed in results.unplayed_at_clear]
+    print(f"\nTransport: {args.transport}")
+    print(f"Calls: {results.completed} completed, {results.failed} failed in {elapsed:.1f}s "
+          f"({results.completed / elapsed:.2f} calls/s, concurrency {args.concurrency})")
+    if args.incoming_call:
+        print(f"Admission:         {len(results.hold_times)} admitted ({results.degraded} degraded), "
+              f"{results.rejected} turned away; on hold p50 {percentile(results.hold_times, 50):.1f} s  "
+              f"p99 {percentile(results.hold_times, 99):.1f} s")
+        if len(results.streams) > 1:
+            print("Workers:           " + ", ".join(f"{netloc} {count} calls"
+                                                   for netloc, count in sorted(results.streams.items())))
+    print(f"Call setup:        p50 {percentile(results.setup_times, 50) * 1000:7.1f} ms  "
+          f"p99 {percentile(results.setup_times, 99) * 1000:7.1f} ms")
+    print(f"First audio:       p50 {percentile(results.first_audio, 50) * 1000:7.1f} ms  "
+          f"p99 {percentile(results.first_audio, 99) * 1000:7.1f} ms")
+    if args.transport == 'twilio':
+        print(f"Relay latency:     p50 {percentile(latencies_ms, 50):7.2f} ms  "
+              f"p99 {percentile(latencies_ms, 99):7.2f} ms  ({len(latencies_ms)} frames starting playback)")
+        print(f"Buffered at Twilio:p50 {percentile(leads_ms, 50):7.1f} ms  "
+              f"p99 {percentile(leads_ms, 99):7.1f} ms  (unplayed audio when a frame arrives)")
+        print(f"Cleared unplayed:  p50 {percentile(unplayed_ms, 50):7.1f} ms  "
+              f"p99 {percentile(unplayed_ms, 99):7.1f} ms  ({len(unplayed_ms)} barge-ins)")
+    else:
+        print(f"Relay latency:     p50 {percentile(latencies_ms, 50):7.2f} ms  "
+              f"p99 {percentile(latencies_ms, 99):7.2f} ms  ({len(latencies_ms)} frames)")
+    if results.turn_latencies:
+        minutes = sorted({minute for minute, _ in results.turn_latencies})
+        for minute in (minutes[0], minutes[-1]) if len(minutes) > 1 else minutes:
+            turns_ms = [latency * 1000 for turn_minute, latency in results.turn_latencies if turn_minute == minute]
+            print(f"Turn latency, min {minute + 1:<3}p50 {percentile(turns_ms, 50):7.1f} ms  "
+                  f"p99 {percentile(turns_ms, 99):7.1f} ms  ({len(turns_ms)} turns, end of caller turn "
+                  f"to first answer audio)")
+    print(f"Frames:            {results.frames_sent} sent, {results.frames_received} received")
+    print(f"Bytes:             {results.bytes_sent} sent, {results.bytes_received} received")
+    upstream = {}
+    for url in worker_urls(args):
+        for sample, value in (await asyncio.to_thread(server_metrics, url, 'relay_upstream_')).items():
+            upstream[sample] = upstream.get(sample, 0) + value
+    resumed = metric_total(upstream, 'relay_upstream_reconnects_total', 'result="resumed"')
+    failed = metric_total(upstream, 'relay_upstream_reconnects_total', 'result="failed"')
+    if resumed or failed:
+        recovery_s = metric_total(upstream, 'relay_upstream_recovery_seconds_sum')
+        lost_s = metric_total(upstream, 'relay_upstream_lost_audio_seconds_total')
+        print(f"Upstream resumes:  {resumed:.0f} resumed, {failed:.0f} failed, "
+              f"mean recovery {recovery_s / max(resumed, 1) * 1000:.1f} ms, {lost_s * 1000:.0f} ms caller speech lost")
+    tools = {}
+    for url in worker_urls(args):
+        for sample, value in (await asyncio.to_thread(server_metrics, url, 'relay_tool_')).items():
+            tools[sample] = tools.get(sample, 0) + value
+    tool_calls = metric_total(tools, 'relay_tool_calls_total')
+    if tool_calls:
+        hits = metric_total(tools, 'relay_tool_calls_total', 'result="hit"')
+        failed = sum(metric_total(tools, 'relay_tool_calls_total', f'result="{result}"')
+                     for result in ('error', 'timeout', 'unknown'))
+        print(f"Tool calls:        {tool_calls:.0f} calls, {hits / tool_calls:.0%} cache hits, {failed:.0f} failed, "
+              f"mean {metric_total(tools, 'relay_tool_seconds_sum') / tool_calls * 1000:.1f} ms")
+    stats_after = process_stats(server_pid) if server_pid else None
+    if stats_before and stats_after:
+        live_calls = min(args.concurrency, args.calls)
+        cpu_pct = (stats_after[0] - stats_before[0]) / elapsed * 100
+        print(f"Server CPU:        {cpu_pct:.1f}% of a core total, {cpu_pct / live_calls:.2f}% per call")
+        print(f"Server RSS:        peak {peak_rss / 2**20:.1f} MiB, "
+              f"{(peak_rss - stats_before[1]) / live_calls / 1024:.1f} KiB per call")
+    return results
+
+
+def spawn_servers(args):
+    """Start mock_realtime.py and main.py as subprocesses; returns them."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    mock = subprocess.Popen([sys.executable, os.path.join(here, 'mock_realtime.py'),
+                             '--port', str(args.mock_port)] + args.mock_args)
+    env = dict(os.environ, PORT=str(args.port), OPENAI_API_KEY=os.getenv('OPENAI_API_KEY', 'mock'),
+               OPENAI_REALTIME_URL=f'ws://localhost:{args.mock_port}', WORKERS=str(args.workers))
+    output = subprocess.DEVNULL if args.quiet else None
+    server = subprocess.Popen([sys.executable, os.path.join(here, 'main.py')], env=env,
+                              stdout=output, stderr=output)
+    return mock, server
+
+
+async def wait_for_server(url, timeout=15):
+    """Wait until the server behind `url` accepts TCP connections."""
+    parsed = urlparse(url)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(parsed.hostname, parsed.port or 80)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent Twilio callers.")
+    parser.add_argument('--url', help='stream URL (default ws://localhost:PORT/media-stream, '
+                                      'or /browser-stream for browser transports)')
+    parser.add_argument('--transport', choices=('twilio',) + browser_transport.TRANSPORTS, default='twilio',
+                        help='simulate Twilio calls, or browser pages in the JSON or binary format')
+    parser.add_argument('--calls', type=int, default=20, help='total calls to place')
+    parser.add_argument('--concurrency', type=int, default=10, help='calls live at once')
+    parser.add_argument('--duration', type=float, default=10, help='seconds of audio per call')
+    parser.add_argument('--incoming-call', action='store_true',
+                        help='place Twilio calls through /incoming-call and follow its TwiML')
+    parser.add_argument('--ramp', type=float, default=0, help='new calls per second (0 = all at once)')
+    parser.add_argument('--server-pid', type=int, help='pid of the server for CPU/RSS figures')
+    parser.add_argument('--spawn', action='store_true', help='start mock_realtime.py and main.py')
+    parser.add_argument('--port', type=int, default=5050, help='server port when spawning')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes when spawning, on --port and the ports after it')
+    parser.add_argument('--mock-port', type=int, default=8765)
+    parser.add_argument('--quiet', action='store_true', help='hide server output when spawning')
+    parser.add_argument('mock_args', nargs='*', help='extra mock_realtime.py options after --')
+    args = parser.parse_args()
+    path = '/media-stream' if args.transport == 'twilio' else '/browser-stream'
+    args.url = args.url or f'ws://localhost:{args.port}{path}'
+
+    processes = spawn_servers(args) if args.spawn else ()
+    try:
+        if processes:
+            for url in worker_urls(args):
+                asyncio.run(wait_for_server(url))
+        asyncio.run(run_load(args, processes[1].pid if processes else args.server_pid))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
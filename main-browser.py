@@ -5,18 +5,20 @@ import asyncio
 import websockets
 from fastapi import FastAPI, WebSocket, Request
 from fastapi.responses import JSONResponse
+import browser_transport
+import eventlog
 
-# Add debug logging
-import logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+# Queued, sampled logging; set LOG_LEVEL=DEBUG for per-chunk records
+eventlog.setup()
 
 @app.websocket("/browser-stream")
 async def handle_browser_stream(websocket: WebSocket):
     """Handle WebSocket connections directly from the browser."""
-    logger.info("Browser client attempting to connect")
     await websocket.accept()
-    logger.info("Browser client connected")
+    call_log = eventlog.CallLog('browser')
+    call_log.info('browser.connect', "Browser client connected")
+    # ?transport=binary sends raw PCM16 as binary messages instead of base64 in JSON
+    binary = websocket.query_params.get('transport') == browser_transport.BINARY
 
     try:
         async with websockets.connect(
@@ -26,7 +28,7 @@ async def handle_browser_stream(websocket: WebSocket):
                 "OpenAI-Beta": "realtime=v1"
             }
         ) as openai_ws:
-            logger.info("Connected to OpenAI WebSocket")
+            call_log.info('browser.openai_connect', "Connected to OpenAI WebSocket")
 
             # Initialize session specifically for browser PCM16
             session_update = {
@@ -41,34 +43,54 @@ async def handle_browser_stream(websocket: WebSocket):
                     "temperature": 0.8,
                 }
             }
-            logger.debug(f"Sending session update: {json.dumps(session_update)}")
+            call_log.debug('browser.session_update', "Sending session update: %s", eventlog.lazy(json.dumps, session_update))
             await openai_ws.send(json.dumps(session_update))
+            if binary:
+                await websocket.send_text(browser_transport.transport_message(browser_transport.BINARY, 24000))
 
             async def receive_from_browser():
                 """Receive audio data from browser and forward to OpenAI."""
                 try:
-                    async for message in websocket.iter_text():
-                        data = json.loads(message)
-                        if data['event'] == 'media' and openai_ws.open:
-                            logger.debug("Received browser audio chunk")
+                    while True:
+                        message = await websocket.receive()
+                        if message['type'] == 'websocket.disconnect':
+                            break
+                        if message.get('bytes') is not None:
+                            kind, _, audio = browser_transport.parse_frame(message['bytes'])
+                            if kind != browser_transport.AUDIO:
+                                continue
+                            payload = base64.b64encode(audio).decode('ascii')
+                        else:
+                            data = json.loads(message['text'])
+                            if data['event'] != 'media':
+                                continue
+                            payload = data['media']['payload']
+                        if openai_ws.open:
+                            call_log.debug('browser.audio_in', "Received browser audio chunk")
                             audio_append = {
                                 "type": "input_audio_buffer.append",
-                                "audio": data['media']['payload']
+                                "audio": payload
                             }
                             await openai_ws.send(json.dumps(audio_append))
                 except Exception as e:
-                    logger.error(f"Error in receive_from_browser: {str(e)}")
+                    call_log.error('browser.error', "Error in receive_from_browser: %s", e)
                     raise
 
             async def send_to_browser():
                 """Receive from OpenAI and send to browser."""
+                sequence = 0
                 try:
                     async for message in openai_ws:
                         response = json.loads(message)
-                        logger.debug(f"OpenAI event type: {response.get('type')}")
+                        call_log.debug('browser.openai_event', "OpenAI event type: %s", response.get('type'))
                         
-                        if response.get('type') == 'response.audio.delta':
-                            logger.debug("Sending audio chunk to browser")
+                        if response.get('type') == 'response.audio.delta' and binary:
+                            call_log.debug('browser.audio_out', "Sending binary audio chunk to browser")
+                            audio = base64.b64decode(response.get('delta', ''))
+                            await websocket.send_bytes(browser_transport.audio_frame(audio, sequence))
+                            sequence += 1
+                        elif response.get('type') == 'response.audio.delta':
+                            call_log.debug('browser.audio_out', "Sending audio chunk to browser")
                             await websocket.send_json({
                                 "event": "media",
                                 "media": {
@@ -76,16 +98,16 @@ async def handle_browser_stream(websocket: WebSocket):
                                 }
                             })
                 except Exception as e:
-                    logger.error(f"Error in send_to_browser: {str(e)}")
+                    call_log.error('browser.error', "Error in send_to_browser: %s", e)
                     raise
 
             await asyncio.gather(receive_from_browser(), send_to_browser())
 
     except Exception as e:
-        logger.error(f"WebSocket error: {str(e)}")
+        call_log.error('browser.error', "WebSocket error: %s", e)
         raise
     finally:
-        logger.info("Browser client disconnected")
+        call_log.info('browser.disconnect', "Browser client disconnected")
 
 # Test endpoint
 @app.get("/test-browser-stream")
@@ -97,5 +119,5 @@ async def test_browser_stream():
         "output_format": "pcm16",
         "websocket_status": "configured"
     }
-    logger.info(f"Test endpoint accessed: {json.dumps(test_config)}")
+    eventlog.info('browser.test', "Test endpoint accessed: %s", eventlog.lazy(json.dumps, test_config))
     return JSONResponse(content=test_config)
\ No newline at end of file
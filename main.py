@@ -1,20 +1,47 @@
 import os
 import json
+import signal
+import tempfile
+import time
+import uuid
 import base64
 import asyncio
-import websockets
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
 from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.websockets import WebSocketDisconnect
-from twilio.twiml.voice_response import VoiceResponse, Connect, Say, Stream
+from twilio.twiml.voice_response import Connect
 from dotenv import load_dotenv
 import numpy as np 
+import relay
+import metrics
+import audio_codec
+from realtime_pool import RealtimePool
+from greeting_cache import GreetingCache
+from vad import VoiceGate
+from pumps import Pump, MERGE, DROP_OLDEST, run_until_first_exits
+from playout import Playout
+import browser_transport
+import eventlog
+from recording import RecordingWriter, CALLER, ASSISTANT
+from upstream import ResilientSession, ResumeFailed
+from compaction import ContextCompactor
+from admission import Admission, ACCEPT, QUEUE, DEGRADE
+from workers import Cluster, supervise
+from tools import ToolRegistry, ToolRunner
+from profiles import ProfileRegistry, ProfileError
 
 load_dotenv()
 
 # Configuration
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 PORT = int(os.getenv('PORT', 80))
+# Point this at mock_realtime.py to run the server without the real API.
+OPENAI_REALTIME_URL = os.getenv(
+    'OPENAI_REALTIME_URL',
+    'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-10-01'
+)
 SYSTEM_MESSAGE = (
     "You are a helpful and bubbly AI assistant who loves to chat about "
     "anything the user is interested in and is prepared to offer them facts. "
@@ -22,102 +49,282 @@ SYSTEM_MESSAGE = (
     "Always stay positive, but work in a joke when appropriate."
 )
 VOICE = 'alloy'
+GREETING_TEXT = (
+    "Hello there! I am an AI voice assistant powered by Twilio and the OpenAI "
+    "Realtime API. You can ask me for facts, jokes, or anything you can imagine. "
+    "How can I help you?"
+)
+# Milliseconds of caller audio to batch into one input_audio_buffer.append (0 sends every frame).
+INBOUND_COALESCE_MS = int(os.getenv('INBOUND_COALESCE_MS', 60))
+# Bounds of each direction's relay queue. Past them, queued audio is merged into fewer
+# messages, then the oldest queued audio is dropped. Paced assistant audio waits in this
+# queue until it is due, so the bound also caps how long a response can be.
+RELAY_QUEUE_MAX_MESSAGES = int(os.getenv('RELAY_QUEUE_MAX_MESSAGES', 256))
+RELAY_QUEUE_MAX_AUDIO_MS = int(os.getenv('RELAY_QUEUE_MAX_AUDIO_MS', 120000))
+# Milliseconds of assistant audio kept buffered at Twilio ahead of playback (0 sends it as it arrives).
+OUTBOUND_LEAD_MS = int(os.getenv('OUTBOUND_LEAD_MS', 300))
+# Send a Twilio mark after about this much assistant audio, and at the end of each response.
+OUTBOUND_MARK_INTERVAL_MS = int(os.getenv('OUTBOUND_MARK_INTERVAL_MS', 250))
+# Drop clearly silent caller audio locally before it reaches OpenAI (see vad.py).
+LOCAL_VAD = os.getenv('LOCAL_VAD', 'false').lower() in ('1', 'true', 'yes')
+LOCAL_VAD_THRESHOLD_DB = float(os.getenv('LOCAL_VAD_THRESHOLD_DB', -45))
+# Directory to persist recorded greeting audio in; unset keeps it in memory only.
+GREETING_CACHE_DIR = os.getenv('GREETING_CACHE_DIR')
+# Directory to write call recordings and transcripts to; unset disables recording.
+RECORDINGS_DIR = os.getenv('RECORDINGS_DIR')
+# Per-call recording buffer. If the disk falls behind, the oldest unwritten data is dropped.
+RECORDING_BUFFER_KB = int(os.getenv('RECORDING_BUFFER_KB', 1024))
 LOG_EVENT_TYPES = [
     'error', 'response.content.done', 'rate_limits.updated',
     'response.done', 'input_audio_buffer.committed',
     'input_audio_buffer.speech_stopped', 'input_audio_buffer.speech_started',
     'session.created'
 ]
-SHOW_TIMING_MATH = False
-
-app = FastAPI()
+# Milliseconds allowed to resume the OpenAI session after its connection drops mid-call (0 ends the call).
+UPSTREAM_RECOVERY_BUDGET_MS = int(os.getenv('UPSTREAM_RECOVERY_BUDGET_MS', 5000))
+# Conversation messages, and milliseconds of not yet committed caller audio, replayed into a resumed session.
+UPSTREAM_REPLAY_ITEMS = int(os.getenv('UPSTREAM_REPLAY_ITEMS', 20))
+UPSTREAM_REPLAY_AUDIO_MS = int(os.getenv('UPSTREAM_REPLAY_AUDIO_MS', 5000))
+# Transcribe caller audio so the caller's turns can be replayed as text (always on when recording).
+# Off by default: Whisper is billed per minute of caller audio on every call.
+UPSTREAM_REPLAY_TRANSCRIBE = os.getenv('UPSTREAM_REPLAY_TRANSCRIBE', 'false').lower() in ('1', 'true', 'yes')
+TRANSCRIBE_CALLER = bool(RECORDINGS_DIR) or (UPSTREAM_RECOVERY_BUDGET_MS > 0 and UPSTREAM_REPLAY_TRANSCRIBE)
+# Compact a call's conversation once a response's context exceeds this many tokens (0 disables).
+CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', 16000))
+# Also compact once the conversation holds this many seconds of audio (0 disables).
+CONTEXT_MAX_AUDIO_SECONDS = int(os.getenv('CONTEXT_MAX_AUDIO_SECONDS', 0))
+# Newest items kept as they are when compacting; older ones become a text summary of at most this many characters.
+CONTEXT_KEEP_ITEMS = int(os.getenv('CONTEXT_KEEP_ITEMS', 8))
+CONTEXT_SUMMARY_CHARS = int(os.getenv('CONTEXT_SUMMARY_CHARS', 2000))
+# Calls this process takes at once, counting calls accepted but not yet streaming (0 = no cap).
+ADMISSION_MAX_CALLS = int(os.getenv('ADMISSION_MAX_CALLS', 0))
+# Also stop admitting calls normally when the OpenAI rate limits have fewer requests or tokens left than this.
+ADMISSION_MIN_REQUESTS = int(os.getenv('ADMISSION_MIN_REQUESTS', 0))
+ADMISSION_MIN_TOKENS = int(os.getenv('ADMISSION_MIN_TOKENS', 0))
+# What happens to the other calls: queue (on hold until there is room), degrade (cheaper session) or reject.
+ADMISSION_POLICY = os.getenv('ADMISSION_POLICY', 'queue')
+# Longest a caller stays on hold before being turned away, and seconds between checks for room.
+ADMISSION_QUEUE_TIMEOUT = int(os.getenv('ADMISSION_QUEUE_TIMEOUT', 60))
+ADMISSION_HOLD_SECONDS = int(os.getenv('ADMISSION_HOLD_SECONDS', 5))
+# Longest spoken answer, in output tokens, for calls degraded while the rate limits are low.
+DEGRADED_MAX_OUTPUT_TOKENS = int(os.getenv('DEGRADED_MAX_OUTPUT_TOKENS', 150))
+HOLD_MESSAGE = "All of our assistants are busy right now. Please stay on the line."
+BUSY_MESSAGE = "Sorry, all of our assistants are busy. Please call again later."
+# Said before the call connects; <Say> punctuation to improve text-to-speech flow
+INTRO_MESSAGES = [
+    "Please wait while we connect your call to the A. I. voice assistant, powered by Twilio and the Open-A.I. Realtime API",
+    "O.K. you can start talking!",
+]
+# JSON file of per-number and per-route session profiles (see profiles.py); unset serves the default only.
+PROFILES_FILE = os.getenv('PROFILES_FILE')
+# Seconds between checks of PROFILES_FILE for changes.
+PROFILES_RELOAD_SECONDS = int(os.getenv('PROFILES_RELOAD_SECONDS', 5))
+# Module whose register(registry) adds the tools the assistant can call (see tools.py); none by default.
+TOOLS_MODULE = os.getenv('TOOLS_MODULE')
+# Longest a tool may run before the model is told it timed out, and seconds its results are cached (0 = never).
+TOOL_TIMEOUT_MS = int(os.getenv('TOOL_TIMEOUT_MS', 5000))
+TOOL_CACHE_TTL = int(os.getenv('TOOL_CACHE_TTL', 300))
+# Tool results kept in the cache, and threads running tools that are plain (blocking) functions.
+TOOL_CACHE_SIZE = int(os.getenv('TOOL_CACHE_SIZE', 1024))
+TOOL_THREADS = int(os.getenv('TOOL_THREADS', 8))
+# Worker processes to spread calls over; with more than one, PORT..PORT+WORKERS-1 are used (see workers.py).
+WORKERS = int(os.getenv('WORKERS', 1))
+# Set by the supervisor in each worker it starts.
+WORKER_INDEX = os.getenv('WORKER_INDEX')
+# Where workers publish their health for each other and the supervisor.
+WORKER_HEALTH_DIR = os.getenv('WORKER_HEALTH_DIR') or os.path.join(tempfile.gettempdir(), f'relay-workers-{PORT}')
+# Media stream URL given to Twilio; {host}, {port} and {index} name the worker chosen for the call.
+WORKER_STREAM_URL = os.getenv('WORKER_STREAM_URL') or (
+    'wss://{host}:{port}/media-stream' if WORKER_INDEX is not None else 'wss://{host}/media-stream')
+# Longest the supervisor waits for live calls to end when stopping workers.
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT', 3600))
+# Number of connected, configured Realtime sessions kept ready for new calls (0 disables the pool).
+REALTIME_POOL_SIZE = int(os.getenv('REALTIME_POOL_SIZE', 2))
+# Warm sessions with less time than this (seconds) left before they expire are discarded.
+REALTIME_POOL_MIN_REMAINING = int(os.getenv('REALTIME_POOL_MIN_REMAINING', 25 * 60))
+# Capture rates /browser-stream accepts in ?sample_rate=, in Hz
+BROWSER_SAMPLE_RATES = (8000, 48000)
+
+@asynccontextmanager
+async def lifespan(app):
+    eventlog.setup()
+    if recording_writer:
+        recording_writer.start()
+    # Recorded greetings are read from disk here, not when a call first needs one
+    await asyncio.to_thread(greeting_cache.preload)
+    realtime_pool.start()
+    # SIGUSR1 drains this process: no new calls, live ones carry on
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, drain)
+    health_task = asyncio.create_task(report_health()) if cluster else None
+    reload_task = asyncio.create_task(reload_profiles()) if PROFILES_FILE else None
+    yield
+    if health_task:
+        health_task.cancel()
+    if reload_task:
+        reload_task.cancel()
+    await realtime_pool.close()
+    if recording_writer:
+        await asyncio.to_thread(recording_writer.stop)
+    tool_registry.shutdown()
+    eventlog.shutdown()
+
+app = FastAPI(lifespan=lifespan)
 
 if not OPENAI_API_KEY:
     raise ValueError('Missing the OpenAI API key. Please set it in the .env file.')
 
 
-async def initialize_browser_session(openai_ws):
-    """Initialize OpenAI session specifically for browser PCM16 audio."""
-    print("\n[Browser] 🚀 Initializing new session")
-    session_update = {
-        "type": "session.update",
-        "session": {
-            "turn_detection": {"type": "server_vad"},
-            "input_audio_format": "pcm16",
-            "output_audio_format": "pcm16",
-            "voice": "alloy",
-            "instructions": SYSTEM_MESSAGE,
-            "modalities": ["text", "audio"],
-            "temperature": 0.8,
-        }
-    }
-    print(f"[Browser] 📤 Sending session config:\n{json.dumps(session_update, indent=2)}")
-    await openai_ws.send(json.dumps(session_update))
+async def initialize_browser_session(openai_ws, call_log, profile, audio_format='pcm16'):
+    """Configure a pooled session for the browser's audio format and the call's profile."""
+    message = profile.session_update(audio_format)
+    call_log.debug('browser.session_update', "Sending session config: %s", message)
+    await openai_ws.send(message)
 
 @app.websocket("/browser-stream")
 async def handle_browser_stream(websocket: WebSocket):
     """Handle WebSocket connections directly from browser."""
-    print("\n[Browser] 🔌 New connection request")
     await websocket.accept()
-    print("[Browser] ✅ Connection accepted")
+    call_log = eventlog.CallLog('browser')
+    call_log.info('browser.connect', "Connection accepted")
+    # Browsers send PCM16 at ?sample_rate= (default 24 kHz); convert only if the API can't take it as-is
+    try:
+        browser_rate = int(websocket.query_params.get('sample_rate', 24000))
+    except ValueError:
+        browser_rate = 0
+    if not BROWSER_SAMPLE_RATES[0] <= browser_rate <= BROWSER_SAMPLE_RATES[1]:
+        call_log.warning('browser.bad_sample_rate', "Rejected sample_rate %r",
+                         websocket.query_params.get('sample_rate'))
+        await websocket.close(code=1008, reason=f"sample_rate must be {BROWSER_SAMPLE_RATES[0]}-"
+                                                f"{BROWSER_SAMPLE_RATES[1]} Hz")
+        return
+    call_metrics = metrics.CallMetrics('browser')
+    session_format = audio_codec.realtime_format_for('pcm16', browser_rate)
+    inbound_codec = audio_codec.Transcoder('pcm16', session_format, source_rate=browser_rate)
+    outbound_codec = audio_codec.Transcoder(session_format, 'pcm16', target_rate=browser_rate)
+    voice_gate = VoiceGate(session_format, LOCAL_VAD_THRESHOLD_DB) if LOCAL_VAD else None
+    # ?transport=binary sends raw PCM16 as binary messages; anything else keeps the JSON/base64 protocol
+    binary = websocket.query_params.get('transport') == browser_transport.BINARY
+    outbound_sequence = 0
+    recorder = recording_writer.open(call_log.call_id, 'pcm16', browser_rate) if recording_writer else None
+    # ?profile= picks the session profile
+    profile = profiles.lookup(websocket.query_params.get('profile'))
+    admission.call_started()
 
     try:
-        async with websockets.connect(
-            'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-10-01',
-            extra_headers={
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "OpenAI-Beta": "realtime=v1"
-            }
-        ) as openai_ws:
-            print("[Browser] 🤖 Connected to OpenAI")
-            await initialize_browser_session(openai_ws)
+        async with upstream_session(call_log, session_format) as openai_ws:
+            call_log.info('browser.openai_connect', "Connected to OpenAI")
+            await initialize_browser_session(openai_ws, call_log, profile, session_format)
+
+            to_openai = Pump(openai_ws.send, 'browser', 'inbound', relay.audio_append_message,
+                             call_metrics.inbound, policy=MERGE, **relay_queue_bounds(session_format))
+            if binary:
+                # Binary frames are built when queued so their sequence numbers expose drops
+                to_browser = Pump(websocket.send_bytes, 'browser', 'outbound', lambda frame: frame,
+                                  call_metrics.outbound, policy=DROP_OLDEST,
+                                  **relay_queue_bounds(session_format, encoded=False))
+                await websocket.send_text(browser_transport.transport_message(browser_transport.BINARY, browser_rate))
+            else:
+                to_browser = Pump(websocket.send_text, 'browser', 'outbound', browser_transport.json_audio_message,
+                                  call_metrics.outbound, policy=DROP_OLDEST, **relay_queue_bounds(session_format))
+            tool_runner = ToolRunner(tool_registry, to_openai.put_control, call_log) if tool_registry.tools else None
+            if tool_runner:
+                openai_ws.on_resume = tool_runner.cancel
+
+            def queue_inbound_audio(audio_bytes, received_at):
+                """Convert raw browser audio as needed and queue it, base64-encoded, for OpenAI."""
+                audio_bytes = inbound_codec.process(audio_bytes)
+                if voice_gate is not None:
+                    audio_bytes = apply_voice_gate(voice_gate, audio_bytes, call_metrics)
+                    if not audio_bytes:
+                        return
+                to_openai.put_audio(base64.b64encode(audio_bytes).decode('ascii'), received_at)
 
             async def receive_from_browser():
                 try:
-                    async for message in websocket.iter_text():
-                        data = json.loads(message)
-                        print(f"\n[Browser] 📥 Received data type: {data.get('type')}")
-                        
+                    while True:
+                        message = await websocket.receive()
+                        if message['type'] == 'websocket.disconnect':
+                            break
+                        received_at = time.perf_counter()
+                        if message.get('bytes') is not None:
+                            kind, _, audio_bytes = browser_transport.parse_frame(message['bytes'])
+                            call_log.debug('browser.audio_in', "Received binary frame kind %d, %d bytes",
+                                           kind, len(audio_bytes))
+                            if kind == browser_transport.AUDIO:
+                                if recorder:
+                                    recorder.audio(CALLER, audio_bytes)
+                                queue_inbound_audio(audio_bytes, received_at)
+                            continue
+
+                        data = json.loads(message['text'])
                         if data['type'] == 'audio':
-                            audio_bytes = base64.b64decode(data['audio'])
-                            print(f"[Browser] 🎤 Audio data size: {len(audio_bytes)} bytes")
-                            
-                            audio_data = {
-                                "type": "input_audio_buffer.append",
-                                "audio": data['audio']
-                            }
-                            await openai_ws.send(json.dumps(audio_data))
-                            print("[Browser] 📤 Forwarded audio to OpenAI")
+                            payload = data['audio']
+                            call_log.debug('browser.audio_in', "Received audio, %d bytes", relay.decoded_size(payload))
+                            if recorder:
+                                recorder.audio(CALLER, payload)
+                            if inbound_codec.passthrough and voice_gate is None:
+                                # Already base64 in the session's format, forward it untouched
+                                to_openai.put_audio(payload, received_at)
+                            else:
+                                queue_inbound_audio(base64.b64decode(payload), received_at)
                 except Exception as e:
-                    print(f"[Browser] ❌ Error in receive_from_browser: {str(e)}")
+                    call_log.error('browser.error', "Error in receive_from_browser: %s", e)
 
             async def send_to_browser():
+                nonlocal outbound_sequence
                 try:
                     async for message in openai_ws:
+                        received_at = time.perf_counter()
                         response = json.loads(message)
                         event_type = response.get('type', 'unknown')
-                        print(f"\n[Browser] 📥 OpenAI event: {event_type}")
+                        call_log.debug('browser.openai_event', "OpenAI event: %s", event_type)
 
                         if event_type == 'response.audio.delta':
-                            audio_bytes = base64.b64decode(response['delta'])
-                            print(f"[Browser] 🔊 Response audio size: {len(audio_bytes)} bytes")
-                            
-                            await websocket.send_json({
-                                'type': 'audio',
-                                'audio': response['delta']
-                            })
-                            print("[Browser] 📤 Sent audio to browser")
+                            payload = response['delta']
+                            call_log.debug('browser.audio_out', "Response audio, %d bytes", relay.decoded_size(payload))
+                            audio = payload
+                            if binary:
+                                audio = outbound_codec.process(base64.b64decode(payload))
+                                payload = browser_transport.audio_frame(audio, outbound_sequence)
+                                outbound_sequence += 1
+                            elif not outbound_codec.passthrough:
+                                audio = outbound_codec.process(base64.b64decode(payload))
+                                payload = base64.b64encode(audio).decode('ascii')
+
+                            to_browser.put_audio(payload, received_at)
+                            if recorder:
+                                recorder.audio(ASSISTANT, audio)
+                        elif event_type == 'input_audio_buffer.speech_stopped':
+                            call_metrics.speech_stopped()
+                        elif event_type == 'rate_limits.updated':
+                            admission.rate_limits.update(response['rate_limits'])
+                        elif tool_runner and event_type in ('response.function_call_arguments.done', 'response.done',
+                                                             'input_audio_buffer.speech_started'):
+                            tool_runner.observe(response)
                         elif event_type == 'session.created':
-                            print(f"[Browser] 📋 Session details:\n{json.dumps(response, indent=2)}")
+                            call_log.debug('browser.session', "Session details: %s", eventlog.lazy(json.dumps, response))
+                        elif recorder:
+                            record_transcript(recorder, response)
                 except Exception as e:
-                    print(f"[Browser] ❌ Error in send_to_browser: {str(e)}")
+                    call_log.error('browser.error', "Error in send_to_browser: %s", e)
 
-            await asyncio.gather(receive_from_browser(), send_to_browser())
+            try:
+                await run_until_first_exits(receive_from_browser(), send_to_browser(),
+                                            to_openai.run(), to_browser.run())
+            finally:
+                if tool_runner:
+                    tool_runner.cancel()
+                to_openai.close()
+                to_browser.close()
     
     except Exception as e:
-        print(f"[Browser] 💥 Fatal error: {str(e)}")
+        call_log.error('browser.error', "Fatal error: %s", e)
     finally:
-        print("[Browser] 🧹 Connection cleanup")
+        call_log.info('browser.disconnect', "Connection cleanup")
+        admission.call_ended()
+        call_metrics.close()
+        if recorder:
+            recorder.close()
         if websocket.client_state.CONNECTED:
             await websocket.close()
 
@@ -125,7 +332,6 @@ async def handle_browser_stream(websocket: WebSocket):
 @app.get("/test-audio-data")  # Changed from WebSocket to HTTP GET
 async def get_test_audio():
     """Generate test audio data and return as JSON."""
-    print("\n[Test] 🎮 Generating test audio data")
     
     # Generate 1 second of 440Hz sine wave at 16kHz
     sample_rate = 16000
@@ -138,13 +344,18 @@ async def get_test_audio():
     audio_bytes = audio_int16.tobytes()
     audio_base64 = base64.b64encode(audio_bytes).decode('utf-8')
     
-    print(f"[Test] 🎵 Generated {len(audio_bytes)} bytes of test audio")
+    eventlog.info('test_audio', "Generated %d bytes of test audio", len(audio_bytes))
     
     return {
         "type": "audio",
         "audio": audio_base64
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Expose per-call latency histograms and relay counters for Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 # Test endpoint to verify server is running and configured
 @app.get("/test-browser-stream")
 async def test_browser_stream():
@@ -154,10 +365,33 @@ async def test_browser_stream():
         "openai_key_configured": bool(OPENAI_API_KEY),
         "endpoints": {
             "browser_websocket": "/browser-stream",
-            "twilio_websocket": "/media-stream"
+            "twilio_websocket": "/media-stream",
+            "metrics": "/metrics"
         }
     }
 
+@app.get("/health")
+async def health_endpoint():
+    """Calls and drain state of this worker (503 while draining, so load balancers stop sending calls)."""
+    health = {"active": admission.active, "max_calls": ADMISSION_MAX_CALLS, "draining": admission.draining,
+              "pid": os.getpid()}
+    if cluster:
+        health["index"] = cluster.index
+        health["workers"] = [{key: worker[key] for key in ('index', 'port', 'active', 'max_calls', 'draining')}
+                             for worker in sorted(cluster.workers(), key=lambda worker: worker['index'])]
+    return JSONResponse(health, status_code=503 if admission.draining else 200)
+
+def drain():
+    admission.draining = True
+    eventlog.info('drain', "Draining: taking no new calls, %d live", admission.active)
+    if cluster:
+        cluster.report(admission.active, ADMISSION_MAX_CALLS, True, admission.waiting())
+
+async def report_health():
+    while True:
+        cluster.report(admission.active, ADMISSION_MAX_CALLS, admission.draining, admission.waiting())
+        await asyncio.sleep(1)
+
 @app.get("/", response_class=JSONResponse)
 async def index_page():
     return {"message": "Twilio Media Stream Server is running!"}
@@ -165,187 +399,446 @@ async def index_page():
 @app.api_route("/incoming-call", methods=["GET", "POST"])
 async def handle_incoming_call(request: Request):
     """Handle incoming call and return TwiML response to connect to Media Stream."""
-    response = VoiceResponse()
-    # <Say> punctuation to improve text-to-speech flow
-    response.say("Please wait while we connect your call to the A. I. voice assistant, powered by Twilio and the Open-A.I. Realtime API")
-    response.pause(length=1)
-    response.say("O.K. you can start talking!")
+    params = dict(request.query_params)
+    params.update(parse_qsl((await request.body()).decode('utf-8')))
+    call_id = params.get('CallSid') or uuid.uuid4().hex
+    # With several workers, the call goes to the one with the most room, and callers held
+    # by any worker are queued together (a hold redirect may land on another worker)
+    if cluster:
+        worker = cluster.pick()
+        held, settled = cluster.hold_queue()
+        decision = admission.admit(call_id, worker is not None, held, settled)
+    else:
+        worker = None
+        decision = admission.admit(call_id)
+    # The profile named by the route (?profile=), else the one for the dialled number
+    profile = profiles.lookup(params.get('profile'), params.get('To'))
+    if decision == QUEUE:
+        # Twilio asks again after the pause; the message is only said the first time
+        twiml = profile.held_twiml if 'held' in params else profile.hold_twiml
+        return HTMLResponse(content=twiml, media_type="application/xml")
+    if decision not in (ACCEPT, DEGRADE):
+        return HTMLResponse(content=profile.busy_twiml, media_type="application/xml")
+
+    if worker is None:
+        worker = {'index': 0, 'port': PORT}
+    else:
+        cluster.placed(worker, call_id)
+    if not cluster or worker['index'] == cluster.index:
+        # Start warming a Realtime session now so it is ready when Twilio opens the stream
+        realtime_pool.warm()
     host = request.url.hostname
+    url = WORKER_STREAM_URL.format(host=host, port=worker['port'], index=worker['index'])
     connect = Connect()
-    connect.stream(url=f'wss://{host}/media-stream')
-    response.append(connect)
-    return HTMLResponse(content=str(response), media_type="application/xml")
+    # Twilio stream URLs can't carry a query string, so the profile goes in the path
+    stream = connect.stream(url=url if profile is profiles.default else f'{url}/{profile.name}')
+    stream.parameter(name='callId', value=call_id)
+    if decision == DEGRADE:
+        stream.parameter(name='degraded', value='true')
+    return HTMLResponse(content=profile.connect_twiml(connect), media_type="application/xml")
 
 @app.websocket("/media-stream")
-async def handle_media_stream(websocket: WebSocket):
+@app.websocket("/media-stream/{profile_name}")
+async def handle_media_stream(websocket: WebSocket, profile_name: str = None):
     """Handle WebSocket connections between Twilio and OpenAI."""
-    print("Client connected")
+    profile = profiles.lookup(profile_name)
     await websocket.accept()
-
-    async with websockets.connect(
-        'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-10-01',
-        extra_headers={
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "OpenAI-Beta": "realtime=v1"
-        }
-    ) as openai_ws:
-        await initialize_session(openai_ws)
+    call_log = eventlog.CallLog('twilio')
+    call_log.info('twilio.connect', "Client connected")
+    call_metrics = metrics.CallMetrics('twilio')
+    recorder = recording_writer.open(call_log.call_id, 'g711_ulaw') if recording_writer else None
+    admission.call_started()
+    try:
+        await relay_media_stream(websocket, call_metrics, call_log, profile, recorder)
+    except ResumeFailed:
+        pass  # logged when the last attempt failed
+    finally:
+        admission.call_ended()
+        call_metrics.close()
+        if recorder:
+            recorder.close()
+
+async def relay_media_stream(websocket, call_metrics, call_log, profile, recorder=None):
+    """Relay one Twilio Media Stream to a pooled OpenAI Realtime session."""
+    async with upstream_session(call_log, 'g711_ulaw') as openai_ws:
+        # Pooled sessions are configured with the default profile
+        if profile is not profiles.default:
+            await openai_ws.send(profile.session_update('g711_ulaw'))
+        # Play the greeting from the cache if it has been recorded, otherwise have
+        # the model speak it and record it. Profiles without a greeting let the
+        # caller speak first.
+        greeting = None
+        greeting_recording = None
+        greeting_item = None
+        if profile.greeting:
+            greeting = greeting_cache.get(profile.voice, profile.greeting, 'g711_ulaw')
+            if greeting is None:
+                await send_initial_conversation_item(openai_ws, profile)
+                greeting_recording = greeting_cache.record(profile.voice, profile.greeting, 'g711_ulaw')
+            else:
+                greeting_item = await seed_greeting(openai_ws, greeting.transcript)
 
         # Connection specific state
         stream_sid = None
-        latest_media_timestamp = 0
+        media_prefix = relay.media_frame_prefix(stream_sid)
         last_assistant_item = None
-        mark_queue = []
-        response_start_timestamp_twilio = None
+        playout = Playout(OUTBOUND_LEAD_MS)
+        unmarked_ms = 0
+        mark_count = 0
+        inbound_audio = relay.AudioCoalescer(INBOUND_COALESCE_MS)
+        voice_gate = VoiceGate('g711_ulaw', LOCAL_VAD_THRESHOLD_DB) if LOCAL_VAD else None
+
+        # Each direction is written by its own task, so a slow socket only delays its own queue
+        to_openai = Pump(openai_ws.send, 'twilio', 'inbound', relay.audio_append_message,
+                         call_metrics.inbound, policy=MERGE, **relay_queue_bounds('g711_ulaw'))
+        def assistant_audio_sent(payload, received_at):
+            call_metrics.outbound(payload, received_at)
+            recorder.audio(ASSISTANT, payload)
+
+        # Assistant audio is paced to playback speed, so it waits here rather than at Twilio.
+        # It is recorded as it is sent, so audio cleared on barge-in is left out.
+        to_twilio = Pump(websocket.send_text, 'twilio', 'outbound',
+                         lambda payload: relay.media_frame(media_prefix, payload),
+                         assistant_audio_sent if recorder else call_metrics.outbound,
+                         policy=DROP_OLDEST, pacer=playout, **relay_queue_bounds('g711_ulaw'))
+        compactor = None
+        if CONTEXT_MAX_TOKENS or CONTEXT_MAX_AUDIO_SECONDS:
+            compactor = ContextCompactor(to_openai.put_control, 'twilio', CONTEXT_MAX_TOKENS,
+                                         CONTEXT_MAX_AUDIO_SECONDS, CONTEXT_KEEP_ITEMS, CONTEXT_SUMMARY_CHARS)
+        # Tools run off the relay loop; their results are sent once the response asking for them is done
+        tool_runner = ToolRunner(tool_registry, to_openai.put_control, call_log) if tool_registry.tools else None
         
         async def receive_from_twilio():
-            """Receive audio data from Twilio and send it to the OpenAI Realtime API."""
-            nonlocal stream_sid, latest_media_timestamp
+            """Receive audio data from Twilio and queue it for the OpenAI Realtime API."""
+            nonlocal stream_sid, media_prefix, last_assistant_item
             try:
                 async for message in websocket.iter_text():
-                    data = json.loads(message)
-                    if data['event'] == 'media' and openai_ws.open:
-                        latest_media_timestamp = int(data['media']['timestamp'])
-                        audio_append = {
-                            "type": "input_audio_buffer.append",
-                            "audio": data['media']['payload']
-                        }
-                        await openai_ws.send(json.dumps(audio_append))
+                    received_at = time.perf_counter()
+                    data = relay.loads(message)
+                    if data['event'] == 'media':
+                        if recorder:
+                            recorder.audio(CALLER, data['media']['payload'])
+                        if voice_gate is None:
+                            send_inbound_audio(inbound_audio.add(data['media']['payload'], received_at))
+                        else:
+                            audio = apply_voice_gate(voice_gate, base64.b64decode(data['media']['payload']), call_metrics)
+                            if audio:
+                                send_inbound_audio(inbound_audio.add_audio(audio, received_at))
                     elif data['event'] == 'start':
+                        send_inbound_audio(inbound_audio.flush())
                         stream_sid = data['start']['streamSid']
-                        print(f"Incoming stream has started {stream_sid}")
-                        response_start_timestamp_twilio = None
-                        latest_media_timestamp = 0
+                        media_prefix = relay.media_frame_prefix(stream_sid)
+                        call_log.stream_sid = stream_sid
+                        call_log.info('twilio.start', "Incoming stream has started")
+                        if recorder:
+                            recorder.event('stream_start', stream_sid=stream_sid)
+                        call_id = data['start'].get('customParameters', {}).get('callId') or data['start'].get('callSid')
+                        admission.stream_started(call_id)
+                        if cluster:
+                            cluster.stream_started(call_id)
+                        if data['start'].get('customParameters', {}).get('degraded') == 'true':
+                            call_log.info('twilio.degraded', "Admitted with the cheaper session configuration")
+                            to_openai.put_control(DEGRADED_SESSION_UPDATE)
                         last_assistant_item = None
+                        if greeting_item:
+                            play_cached_greeting()
                     elif data['event'] == 'mark':
-                        if mark_queue:
-                            mark_queue.pop(0)
+                        playout.mark_played(data['mark']['name'], received_at)
+                    elif data['event'] == 'stop':
+                        send_inbound_audio(inbound_audio.flush())
             except WebSocketDisconnect:
-                print("Client disconnected.")
-                if openai_ws.open:
-                    await openai_ws.close()
+                pass
+            call_log.info('twilio.disconnect', "Client disconnected")
 
         async def send_to_twilio():
-            """Receive events from the OpenAI Realtime API, send audio back to Twilio."""
-            nonlocal stream_sid, last_assistant_item, response_start_timestamp_twilio
+            """Receive events from the OpenAI Realtime API, queue audio back to Twilio."""
+            nonlocal greeting_recording
             try:
                 async for openai_message in openai_ws:
-                    response = json.loads(openai_message)
+                    received_at = time.perf_counter()
+                    # Fast path: pass audio deltas through to Twilio without parsing them.
+                    if relay.event_type(openai_message) == relay.AUDIO_DELTA:
+                        fields = relay.split_audio_delta(openai_message)
+                        if fields is not None:
+                            forward_audio_delta(*fields, received_at)
+                            continue
+
+                    response = relay.loads(openai_message)
                     if response['type'] in LOG_EVENT_TYPES:
-                        print(f"Received event: {response['type']}", response)
+                        call_log.info('twilio.openai_event', "Received event: %s %s", response['type'], response)
+
+                    if response['type'] == 'rate_limits.updated':
+                        admission.rate_limits.update(response['rate_limits'])
 
                     if response.get('type') == 'response.audio.delta' and 'delta' in response:
-                        audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
-                        audio_delta = {
-                            "event": "media",
-                            "streamSid": stream_sid,
-                            "media": {
-                                "payload": audio_payload
-                            }
-                        }
-                        await websocket.send_json(audio_delta)
-
-                        if response_start_timestamp_twilio is None:
-                            response_start_timestamp_twilio = latest_media_timestamp
-                            if SHOW_TIMING_MATH:
-                                print(f"Setting start timestamp for new response: {response_start_timestamp_twilio}ms")
-
-                        # Update last_assistant_item safely
-                        if response.get('item_id'):
-                            last_assistant_item = response['item_id']
-
-                        await send_mark(websocket, stream_sid)
+                        forward_audio_delta(response.get('item_id'), response['delta'], received_at)
+
+                    if response.get('type') == 'response.audio.done':
+                        send_mark()
+
+                    if recorder:
+                        record_transcript(recorder, response)
+
+                    if compactor is not None and compactor.observe(response):
+                        call_log.info('twilio.compacted', "Compacted the conversation at %d input tokens, "
+                                      "%.0fs of audio left", compactor.input_tokens, compactor.audio_ms / 1000)
+
+                    if tool_runner is not None:
+                        tool_runner.observe(response)
+
+                    if response.get('type') == 'input_audio_buffer.speech_stopped':
+                        call_metrics.speech_stopped()
+
+                    if greeting_recording is not None:
+                        if response['type'] == 'response.audio_transcript.done':
+                            greeting_recording.transcript = response['transcript']
+                        elif response['type'] == 'response.done':
+                            if await greeting_recording.finish(response['response']['status']):
+                                call_log.info('greeting.recorded', "Recorded greeting audio for later calls")
+                            greeting_recording = None
 
                     # Trigger an interruption. Your use case might work better using `input_audio_buffer.speech_stopped`, or combining the two.
                     if response.get('type') == 'input_audio_buffer.speech_started':
-                        print("Speech started detected.")
+                        call_log.debug('twilio.speech_started', "Speech started detected")
+                        send_inbound_audio(inbound_audio.flush())
                         if last_assistant_item:
-                            print(f"Interrupting response with id: {last_assistant_item}")
-                            await handle_speech_started_event()
+                            call_log.info('twilio.barge_in', "Interrupting response with id: %s", last_assistant_item)
+                            handle_speech_started_event(received_at)
             except Exception as e:
-                print(f"Error in send_to_twilio: {e}")
-
-        async def handle_speech_started_event():
+                call_log.error('twilio.error', "Error in send_to_twilio: %s", e)
+
+        def session_resumed():
+            """The OpenAI connection was replaced; a half-spoken greeting can't be cached."""
+            nonlocal greeting_recording
+            greeting_recording = None
+            # The new session doesn't know the old one's function calls
+            if tool_runner is not None:
+                tool_runner.cancel()
+
+        openai_ws.on_resume = session_resumed
+
+        def send_inbound_audio(batch):
+            """Queue a coalesced batch of caller audio for the OpenAI input buffer."""
+            if batch is not None:
+                to_openai.put_audio(*batch)
+
+        def forward_audio_delta(item_id, delta, received_at):
+            """Queue one base64 audio delta for Twilio as-is."""
+            nonlocal last_assistant_item, unmarked_ms
+            on_sent = None
+            if item_id and item_id != last_assistant_item:
+                # Remember where in the outbound stream this item's audio starts
+                last_assistant_item = item_id
+                on_sent = lambda: playout.start_item(item_id)
+            to_twilio.put_audio(delta, received_at, on_sent)
+            if compactor is not None and item_id != greeting_item:
+                compactor.assistant_audio(item_id, delta)
+            if greeting_recording is not None:
+                greeting_recording.add(delta)
+
+            unmarked_ms += relay.decoded_size(delta) / playout.bytes_per_ms
+            if unmarked_ms >= OUTBOUND_MARK_INTERVAL_MS:
+                send_mark()
+
+        def handle_speech_started_event(started_at):
             """Handle interruption when the caller's speech starts."""
-            nonlocal response_start_timestamp_twilio, last_assistant_item
-            print("Handling speech started event.")
-            if mark_queue and response_start_timestamp_twilio is not None:
-                elapsed_time = latest_media_timestamp - response_start_timestamp_twilio
-                if SHOW_TIMING_MATH:
-                    print(f"Calculating elapsed time for truncation: {latest_media_timestamp} - {response_start_timestamp_twilio} = {elapsed_time}ms")
-
-                if last_assistant_item:
-                    if SHOW_TIMING_MATH:
-                        print(f"Truncating item with ID: {last_assistant_item}, Truncated at: {elapsed_time}ms")
-
+            nonlocal last_assistant_item, unmarked_ms
+            now = time.perf_counter()
+            if len(to_twilio) or playout.busy(now):
+                elapsed_time = playout.item_played_ms(last_assistant_item, now)
+                call_log.debug('twilio.truncate', "Played %.0fms of %.0fms sent, %dms of the current item",
+                               playout.played_ms(now), playout.sent_ms, elapsed_time)
+
+                # The cached greeting is a text item, there is no model audio to truncate
+                if last_assistant_item and last_assistant_item != greeting_item:
+                    call_log.debug('twilio.truncate', "Truncating item with ID: %s, Truncated at: %dms",
+                                   last_assistant_item, elapsed_time)
                     truncate_event = {
                         "type": "conversation.item.truncate",
                         "item_id": last_assistant_item,
                         "content_index": 0,
                         "audio_end_ms": elapsed_time
                     }
-                    await openai_ws.send(json.dumps(truncate_event))
+                    to_openai.put_control(json.dumps(truncate_event))
+                    if recorder:
+                        recorder.event('interrupted', item_id=last_assistant_item, audio_end_ms=elapsed_time)
 
-                await websocket.send_json({
+                # Audio (and its marks) still queued here never reached Twilio; drop it too
+                to_twilio.clear()
+                to_twilio.put_control(json.dumps({
                     "event": "clear",
                     "streamSid": stream_sid
-                })
+                }), on_sent=lambda: cleared(started_at))
 
-                mark_queue.clear()
+                unmarked_ms = 0
                 last_assistant_item = None
-                response_start_timestamp_twilio = None
 
-        async def send_mark(connection, stream_sid):
-            if stream_sid:
+        def cleared(started_at):
+            """Twilio has been told to drop the audio it has not played yet."""
+            playout.clear(time.perf_counter())
+            call_metrics.barge_in(started_at)
+
+        def play_cached_greeting():
+            """Queue the recorded greeting for the caller from memory."""
+            for chunk in greeting.chunks:
+                forward_audio_delta(greeting_item, chunk, time.perf_counter())
+
+        def send_mark():
+            """Queue a mark after the audio queued so far; Twilio echoes it once that has played."""
+            nonlocal unmarked_ms, mark_count
+            if stream_sid and unmarked_ms:
+                mark_count += 1
+                name = f"responsePart{mark_count}"
                 mark_event = {
                     "event": "mark",
                     "streamSid": stream_sid,
-                    "mark": {"name": "responsePart"}
+                    "mark": {"name": name}
                 }
-                await connection.send_json(mark_event)
-                mark_queue.append('responsePart')
-
-        await asyncio.gather(receive_from_twilio(), send_to_twilio())
+                to_twilio.put_control(json.dumps(mark_event), on_sent=lambda: playout.mark_sent(name))
+                unmarked_ms = 0
+
+        try:
+            await run_until_first_exits(receive_from_twilio(), send_to_twilio(),
+                                        to_openai.run(), to_twilio.run())
+        finally:
+            if tool_runner is not None:
+                tool_runner.cancel()
+            to_openai.close()
+            to_twilio.close()
+
+def audio_bytes_per_ms(audio_format):
+    """Raw bytes in a millisecond of `audio_format` audio."""
+    encoding, rate = audio_codec.FORMATS[audio_format]
+    return audio_codec.BYTES_PER_SAMPLE[encoding] * rate // 1000
+
+def relay_queue_bounds(audio_format, encoded=True):
+    """Pump bounds for one direction of a call carrying `audio_format` audio.
+
+    `encoded` says whether the queue holds base64 payloads or raw bytes.
+    """
+    max_audio_bytes = RELAY_QUEUE_MAX_AUDIO_MS * audio_bytes_per_ms(audio_format)
+    return {
+        "max_messages": RELAY_QUEUE_MAX_MESSAGES,
+        # base64 takes 4 characters per 3 bytes
+        "max_audio_bytes": max_audio_bytes * 4 // 3 if encoded else max_audio_bytes,
+    }
 
-async def send_initial_conversation_item(openai_ws):
+def upstream_session(call_log, audio_format):
+    """A pooled OpenAI session for one call, resumed on a new connection if its own drops."""
+    return ResilientSession(realtime_pool, call_log, UPSTREAM_RECOVERY_BUDGET_MS / 1000,
+                            UPSTREAM_REPLAY_ITEMS, UPSTREAM_REPLAY_AUDIO_MS, audio_bytes_per_ms(audio_format))
+
+def record_transcript(recorder, response):
+    """Copy finished transcripts from an OpenAI event into the call recording."""
+    if response['type'] == 'response.audio_transcript.done':
+        recorder.transcript(ASSISTANT, response['transcript'], item_id=response.get('item_id'))
+    elif response['type'] == 'conversation.item.input_audio_transcription.completed':
+        recorder.transcript(CALLER, response['transcript'], item_id=response.get('item_id'))
+
+def apply_voice_gate(voice_gate, audio, call_metrics):
+    """Run caller audio through the local voice gate, counting what it drops."""
+    suppressed = voice_gate.suppressed_bytes
+    audio = voice_gate.process(audio)
+    call_metrics.vad_suppressed(voice_gate.suppressed_bytes - suppressed)
+    return audio
+
+async def send_initial_conversation_item(openai_ws, profile):
     """Send initial conversation item if AI talks first."""
-    initial_conversation_item = {
+    await openai_ws.send(profile.greeting_request)
+    await openai_ws.send(RESPONSE_CREATE)
+
+async def seed_greeting(openai_ws, transcript):
+    """Record in the conversation that the assistant already greeted the caller."""
+    item_id = f"greeting_{uuid.uuid4().hex[:16]}"
+    greeting_item = {
         "type": "conversation.item.create",
         "item": {
+            "id": item_id,
             "type": "message",
-            "role": "user",
+            "role": "assistant",
             "content": [
                 {
-                    "type": "input_text",
-                    "text": "Greet the user with 'Hello there! I am an AI voice assistant powered by Twilio and the OpenAI Realtime API. You can ask me for facts, jokes, or anything you can imagine. How can I help you?'"
+                    "type": "text",
+                    "text": transcript
                 }
             ]
         }
     }
-    await openai_ws.send(json.dumps(initial_conversation_item))
-    await openai_ws.send(json.dumps({"type": "response.create"}))
+    await openai_ws.send(json.dumps(greeting_item))
+    return item_id
 
 
 async def initialize_session(openai_ws):
     """Control initial session with OpenAI."""
-    session_update = {
-        "type": "session.update",
-        "session": {
-            "turn_detection": {"type": "server_vad"},
-            "input_audio_format": "g711_ulaw",
-            "output_audio_format": "g711_ulaw",
-            "voice": VOICE,
-            "instructions": SYSTEM_MESSAGE,
-            "modalities": ["text", "audio"],
-            "temperature": 0.8,
-        }
-    }
-    print('Sending session update:', json.dumps(session_update))
-    await openai_ws.send(json.dumps(session_update))
-
-    # Uncomment the next line to have the AI speak first
-    await send_initial_conversation_item(openai_ws)
+    message = profiles.default.session_update('g711_ulaw')
+    eventlog.debug('session_update', "Sending session update: %s", message)
+    await openai_ws.send(message)
+
+async def reload_profiles():
+    """Pick up changes to PROFILES_FILE; live calls keep the profile they started with."""
+    while True:
+        await asyncio.sleep(PROFILES_RELOAD_SECONDS)
+        default_update = profiles.default.session_update('g711_ulaw')
+        try:
+            if not profiles.reload_if_changed():
+                continue
+        except (OSError, ProfileError) as e:
+            eventlog.error('profiles.invalid', "Keeping the current profiles, %s is invalid: %s", PROFILES_FILE, e)
+            continue
+        eventlog.info('profiles.reloaded', "Loaded profiles: %s", ', '.join(profiles.names()))
+        if profiles.default.session_update('g711_ulaw') != default_update:
+            # Warm sessions were configured with the old default profile
+            realtime_pool.refresh()
+
+RESPONSE_CREATE = json.dumps({"type": "response.create"})
+
+# Sent to calls admitted while the rate limits are low: shorter answers, no caller transcription
+DEGRADED_SESSION_UPDATE = json.dumps({
+    "type": "session.update",
+    "session": {"max_response_output_tokens": DEGRADED_MAX_OUTPUT_TOKENS, "input_audio_transcription": None},
+})
+
+greeting_cache = GreetingCache(GREETING_CACHE_DIR)
+tool_registry = ToolRegistry(TOOL_TIMEOUT_MS / 1000, TOOL_CACHE_TTL, TOOL_CACHE_SIZE, TOOL_THREADS)
+if TOOLS_MODULE:
+    tool_registry.load(TOOLS_MODULE)
+
+# Settings every profile's session.update shares
+profile_session = {}
+if TRANSCRIBE_CALLER:
+    # Caller transcripts for the recording and for resumed sessions
+    profile_session["input_audio_transcription"] = {"model": "whisper-1"}
+if tool_registry.tools:
+    profile_session.update(tools=tool_registry.definitions(), tool_choice="auto")
+profiles = ProfileRegistry({
+    "voice": VOICE,
+    "instructions": SYSTEM_MESSAGE,
+    "temperature": 0.8,
+    "greeting": GREETING_TEXT,
+    "intro": INTRO_MESSAGES,
+    "hold_message": HOLD_MESSAGE,
+    "busy_message": BUSY_MESSAGE,
+}, PROFILES_FILE, profile_session, ADMISSION_HOLD_SECONDS)
+admission = Admission(ADMISSION_MAX_CALLS, ADMISSION_POLICY, ADMISSION_MIN_REQUESTS, ADMISSION_MIN_TOKENS,
+                      ADMISSION_QUEUE_TIMEOUT)
+cluster = Cluster(WORKER_HEALTH_DIR, int(WORKER_INDEX), PORT) if WORKER_INDEX is not None else None
+recording_writer = RecordingWriter(RECORDINGS_DIR, RECORDING_BUFFER_KB * 1024) if RECORDINGS_DIR else None
+
+# Sessions are configured for Twilio when pooled; the browser endpoint re-configures its own.
+realtime_pool = RealtimePool(
+    OPENAI_REALTIME_URL,
+    {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "OpenAI-Beta": "realtime=v1"
+    },
+    initialize_session,
+    size=REALTIME_POOL_SIZE,
+    min_remaining=REALTIME_POOL_MIN_REMAINING,
+)
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    if WORKERS > 1 and WORKER_INDEX is None:
+        supervise(WORKERS, PORT, WORKER_HEALTH_DIR, DRAIN_TIMEOUT)
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=PORT)
@@ -0,0 +1,228 @@
+"""Minimal Prometheus-style metrics for the relay.
+
+Counters, gauges and histograms are plain Python objects updated in
+place from the event loop, so recording on the hot path costs a few
+attribute updates and a bisect. `render()` produces the text exposition
+format served on `/metrics`.
+"""
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from sub-millisecond relay work to multi-second waits.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value).replace('"', '\\"')) for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        _registry.append(self)
+
+    def labels(self, *values):
+        """Return the child metric for the given label values."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            child = self._children[values] = self._new_child()
+        return child
+
+    def __getattr__(self, attr):
+        # Unlabelled metrics proxy straight to their single child.
+        if attr in ('inc', 'dec', 'set', 'observe', 'value') and not self.labelnames:
+            return getattr(self._children[()], attr)
+        raise AttributeError(attr)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child):
+        return [f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}']
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Bucketed observations, rendered with cumulative `le` buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _render_child(self, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {child.sum!r}')
+        lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+def render():
+    """Render every registered metric in the Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+ACTIVE_CALLS = Gauge('relay_active_calls', 'Calls currently connected.', ['transport'])
+CALLS = Counter('relay_calls_total', 'Calls accepted since start.', ['transport'])
+FRAMES = Counter('relay_frames_total', 'Audio messages relayed.', ['transport', 'direction'])
+AUDIO_BYTES = Counter('relay_audio_bytes_total',
+                      'Audio payload bytes relayed (base64, or raw PCM16 for binary browser streams).',
+                      ['transport', 'direction'])
+VAD_SUPPRESSED_BYTES = Counter('relay_vad_suppressed_bytes_total',
+                               'Raw caller audio bytes dropped by the local voice gate.', ['transport'])
+RESPONSE_LATENCY = Histogram('relay_response_latency_seconds',
+                             'End of caller speech (speech_stopped) to first response audio.',
+                             ['transport'])
+FIRST_AUDIO = Histogram('relay_first_audio_seconds', 'Call connect to first assistant audio.',
+                        ['transport'])
+BARGE_IN = Histogram('relay_barge_in_seconds', 'speech_started to caller audio cleared.',
+                     ['transport'])
+RELAY_DELAY = Histogram('relay_queue_delay_seconds',
+                        'Time from receiving a frame on one socket to sending it on the other.',
+                        ['transport', 'direction'])
+
+
+class CallMetrics:
+    """Timing spans and counters for a single call.
+
+    The relay handlers call these hooks at the matching protocol events;
+    they only take timestamps and update pre-bound metric children.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.connected_at = time.perf_counter()
+        self.speech_stopped_at = None
+        self.first_audio_seen = False
+        self.awaiting_response_audio = False
+        self._active = ACTIVE_CALLS.labels(transport)
+        self._frames_in = FRAMES.labels(transport, 'inbound')
+        self._frames_out = FRAMES.labels(transport, 'outbound')
+        self._bytes_in = AUDIO_BYTES.labels(transport, 'inbound')
+        self._bytes_out = AUDIO_BYTES.labels(transport, 'outbound')
+        self._delay_in = RELAY_DELAY.labels(transport, 'inbound')
+        self._delay_out = RELAY_DELAY.labels(transport, 'outbound')
+        self._response_latency = RESPONSE_LATENCY.labels(transport)
+        self._first_audio = FIRST_AUDIO.labels(transport)
+        self._barge_in = BARGE_IN.labels(transport)
+        self._vad_suppressed = VAD_SUPPRESSED_BYTES.labels(transport)
+        CALLS.labels(transport).inc()
+        self._active.inc()
+
+    def close(self):
+        self._active.dec()
+
+    def inbound(self, payload, received_at):
+        """Caller audio forwarded to OpenAI."""
+        self._frames_in.inc()
+        self._bytes_in.inc(len(payload))
+        self._delay_in.observe(time.perf_counter() - received_at)
+
+    def outbound(self, payload, received_at):
+        """Assistant audio forwarded to the caller."""
+        now = time.perf_counter()
+        self._frames_out.inc()
+        self._bytes_out.inc(len(payload))
+        self._delay_out.observe(now - received_at)
+        if not self.first_audio_seen:
+            self.first_audio_seen = True
+            self._first_audio.observe(now - self.connected_at)
+        if self.awaiting_response_audio:
+            self.awaiting_response_audio = False
+            self._response_latency.observe(now - self.speech_stopped_at)
+
+    def vad_suppressed(self, size):
+        """Caller audio dropped by the local voice gate."""
+        self._vad_suppressed.inc(size)
+
+    def speech_stopped(self):
+        self.speech_stopped_at = time.perf_counter()
+        self.awaiting_response_audio = True
+
+    def barge_in(self, started_at):
+        """Caller audio cleared after a speech_started event seen at `started_at`."""
+        self._barge_in.observe(time.perf_counter() - started_at)
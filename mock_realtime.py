@@ -0,0 +1,371 @@
+"""Local stand-in for the OpenAI Realtime API WebSocket, for offline load tests.
+
+Speaks enough of the `wss://api.openai.com/v1/realtime` protocol for
+main.py: session.update, input_audio_buffer.append, conversation.item.*,
+response.create and the server_vad events. Turn detection is simulated
+from the amount of caller audio received: the caller first listens for
+`listen_ms` (long enough for a greeting), then speaks for `speech_ms`,
+and the assistant answers during the next listening window.
+
+With `--drop-after-ms` every session fails with a 1011 close once it has
+received that much caller audio, to exercise session resume.
+
+The first 16 bytes of every `response.audio.delta` carry the wall-clock
+time the delta was sent and the time the caller turn it answers ended
+(little-endian doubles), so a client can measure relay latency and
+per-turn response latency through the server under test. Conversation
+items are counted in approximate tokens, reported in `response.done`
+usage; `--context-latency-ms` adds that much response latency per 1000
+of them, as a growing context does with the real model.
+
+With `--tool-questions N` and tools configured in the session, the
+answer to each caller turn starts with a call to the first tool, with
+arguments `{"question": "question <k>"}` cycling over N questions. The
+spoken answer follows once the client sends the `function_call_output`
+and `response.create`; its deltas still carry the caller turn's end, so
+measured turn latency includes the tool.
+
+    python mock_realtime.py --port 8765 --latency-ms 300 --audio-rate 4
+    OPENAI_REALTIME_URL=ws://localhost:8765 python main.py
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import struct
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import websockets
+
+# Bytes of audio per millisecond for each Realtime audio format.
+BYTES_PER_MS = {
+    'g711_ulaw': 8,
+    'g711_alaw': 8,
+    'pcm16': 48,  # 24 kHz, 16-bit mono
+}
+SILENCE_BYTE = {
+    'g711_ulaw': b'\xff',
+    'g711_alaw': b'\xd5',
+    'pcm16': b'\x00',
+}
+# Send time of the delta and end of the caller turn it answers
+TIMESTAMP = struct.Struct('<dd')
+
+
+@dataclass
+class MockConfig:
+    """Timing of the simulated model."""
+    latency_ms: float = 300      # end of caller speech to first audio delta
+    audio_rate: float = 4.0      # audio generated per wall-clock second; 0 = unpaced
+    delta_ms: int = 100          # audio carried by each response.audio.delta
+    response_ms: int = 2000      # length of each spoken response
+    speech_ms: int = 1500        # caller audio per simulated turn
+    listen_ms: int = 3000        # caller silence between turns
+    drop_after_ms: int = 0       # fail the connection after this much caller audio (0 = never)
+    context_latency_ms: float = 0  # extra latency per 1000 tokens of conversation context
+    requests_per_minute: int = 5000  # account rate limits reported in rate_limits.updated
+    tokens_per_minute: int = 400000
+    tool_questions: int = 0      # distinct tool arguments cycled through by caller turns (0 = no tool calls)
+
+
+def read_timestamp(audio):
+    """Return the send time embedded in a mock audio delta."""
+    return TIMESTAMP.unpack_from(audio)[0]
+
+
+def read_turn_end(audio):
+    """Return when the caller turn a mock audio delta answers ended (or the response was requested)."""
+    return TIMESTAMP.unpack_from(audio)[1]
+
+
+class RateLimiter:
+    """Requests and tokens used by every session in the last minute, as the account limits count them."""
+
+    def __init__(self):
+        self.used = deque()  # (time, tokens) per response
+
+    def record(self, tokens):
+        self.used.append((time.monotonic(), tokens))
+
+    def rate_limits(self, config):
+        now = time.monotonic()
+        while self.used and now - self.used[0][0] >= 60:
+            self.used.popleft()
+        reset = 60 - (now - self.used[0][0]) if self.used else 0
+        tokens = sum(used for _, used in self.used)
+        return [
+            {"name": "requests", "limit": config.requests_per_minute,
+             "remaining": max(0, config.requests_per_minute - len(self.used)), "reset_seconds": round(reset, 3)},
+            {"name": "tokens", "limit": config.tokens_per_minute,
+             "remaining": max(0, config.tokens_per_minute - tokens), "reset_seconds": round(reset, 3)},
+        ]
+
+
+class MockSession:
+    """One simulated Realtime session bound to a client WebSocket."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, ws, config, rate_limiter=None):
+        self.ws = ws
+        self.config = config
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.session = {
+            "id": f"sess_{next(self._ids)}",
+            "model": "mock-realtime",
+            "modalities": ["text", "audio"],
+            "voice": "alloy",
+            "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16",
+            "turn_detection": {"type": "server_vad"},
+            "tools": [],
+        }
+        self.items = []
+        self.tokens = {}  # item id -> approximate context tokens
+        self.received_ms = 0.0
+        self.in_speech = False
+        self.speech_item_id = None
+        self.speech_started_ms = 0
+        self.response_task = None
+        self.tool_turns = 0
+        self.tool_turn_end = None  # end of the caller turn whose answer waits for a tool result
+
+    def new_id(self, prefix):
+        return f"{prefix}_{next(self._ids)}"
+
+    async def emit(self, event_type, **fields):
+        event = {"type": event_type, "event_id": self.new_id('event')}
+        event.update(fields)
+        await self.ws.send(json.dumps(event, separators=(',', ':')))
+
+    async def run(self):
+        await self.emit('session.created', session=self.session)
+        try:
+            async for message in self.ws:
+                await self.handle(json.loads(message))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self.response_task:
+                self.response_task.cancel()
+
+    async def handle(self, event):
+        event_type = event.get('type')
+        if event_type == 'input_audio_buffer.append':
+            await self.append_audio(base64.b64decode(event['audio']))
+        elif event_type == 'session.update':
+            self.session.update(event.get('session', {}))
+            await self.emit('session.updated', session=self.session)
+        elif event_type == 'conversation.item.create':
+            item = dict(event['item'])
+            item.setdefault('id', self.new_id('item'))
+            await self.add_item(item, event.get('previous_item_id'))
+        elif event_type == 'conversation.item.delete':
+            self.items = [item for item in self.items if item['id'] != event['item_id']]
+            self.tokens.pop(event['item_id'], None)
+            await self.emit('conversation.item.deleted', item_id=event['item_id'])
+        elif event_type == 'conversation.item.truncate':
+            await self.emit('conversation.item.truncated', item_id=event['item_id'],
+                            content_index=event.get('content_index', 0),
+                            audio_end_ms=event.get('audio_end_ms', 0))
+        elif event_type == 'response.create':
+            if self.responding:
+                await self.emit('error', error={
+                    "type": "invalid_request_error",
+                    "code": "conversation_already_has_active_response",
+                    "message": "Conversation already has an active response",
+                })
+            else:
+                self.start_response(delay_ms=0)
+        elif event_type == 'response.cancel':
+            await self.cancel_response()
+        elif event_type == 'input_audio_buffer.clear':
+            await self.emit('input_audio_buffer.cleared')
+
+    @property
+    def responding(self):
+        return self.response_task is not None and not self.response_task.done()
+
+    async def add_item(self, item, previous_item_id=None, audio_tokens=0):
+        if previous_item_id == 'root':
+            self.items.insert(0, item)
+        else:
+            self.items.append(item)
+        position = self.items.index(item)
+        previous_item_id = self.items[position - 1]['id'] if position else None
+        text = ''.join(part.get('text') or part.get('transcript') or '' for part in item.get('content', ()))
+        self.tokens[item['id']] = audio_tokens + len(text) // 4
+        await self.emit('conversation.item.created', previous_item_id=previous_item_id, item=item)
+
+    def context_tokens(self):
+        return sum(self.tokens.values())
+
+    async def append_audio(self, audio):
+        """Advance the simulated turn detector by the appended audio."""
+        fmt = self.session.get('input_audio_format', 'pcm16')
+        self.received_ms += len(audio) / BYTES_PER_MS.get(fmt, 48)
+        if self.config.drop_after_ms and self.received_ms >= self.config.drop_after_ms:
+            # Simulate the upstream connection failing mid-call
+            await self.ws.close(code=1011, reason='mock connection failure')
+            return
+        if self.session.get('turn_detection') is None:
+            return
+        cycle = self.config.speech_ms + self.config.listen_ms
+        speaking = (self.received_ms % cycle) >= self.config.listen_ms
+        if speaking and not self.in_speech:
+            self.in_speech = True
+            self.speech_item_id = self.new_id('item')
+            self.speech_started_ms = self.received_ms
+            await self.emit('input_audio_buffer.speech_started',
+                            audio_start_ms=int(self.received_ms), item_id=self.speech_item_id)
+            await self.cancel_response()
+        elif not speaking and self.in_speech:
+            self.in_speech = False
+            item_id = self.speech_item_id
+            await self.emit('input_audio_buffer.speech_stopped', audio_end_ms=int(self.received_ms),
+                            item_id=item_id)
+            await self.emit('input_audio_buffer.committed', item_id=item_id)
+            # Input audio costs about one token per 100 ms
+            await self.add_item({
+                "id": item_id, "type": "message", "role": "user",
+                "content": [{"type": "input_audio", "transcript": None}],
+            }, audio_tokens=int(self.received_ms - self.speech_started_ms) // 100)
+            if self.session.get('input_audio_transcription'):
+                await self.emit('conversation.item.input_audio_transcription.completed',
+                                item_id=item_id, content_index=0,
+                                transcript="This is a simulated caller turn.")
+            tools = self.session.get('tools')
+            self.start_response(delay_ms=self.config.latency_ms,
+                                call_tool=bool(tools) and self.config.tool_questions > 0)
+
+    def start_response(self, delay_ms, call_tool=False):
+        if call_tool:
+            self.response_task = asyncio.create_task(self.call_tool(delay_ms))
+        else:
+            self.response_task = asyncio.create_task(self.respond(delay_ms))
+
+    async def call_tool(self, delay_ms):
+        """A response that only calls the session's first tool."""
+        response_id = self.new_id('resp')
+        item_id = self.new_id('item')
+        call_id = self.new_id('call')
+        turn_end = time.time()
+        input_tokens = self.context_tokens()
+        delay_ms += self.config.context_latency_ms * input_tokens / 1000
+        name = self.session['tools'][0]['name']
+        arguments = json.dumps({"question": f"question {self.tool_turns % self.config.tool_questions}"})
+        self.tool_turns += 1
+        status = 'completed'
+        try:
+            await asyncio.sleep(delay_ms / 1000)
+            await self.emit('response.created', response={"id": response_id, "status": "in_progress"})
+            item = {"id": item_id, "type": "function_call", "status": "completed", "name": name,
+                    "call_id": call_id, "arguments": arguments}
+            await self.emit('response.output_item.added', response_id=response_id, output_index=0, item=item)
+            await self.add_item(item)
+            await self.emit('response.function_call_arguments.done', response_id=response_id, item_id=item_id,
+                            output_index=0, call_id=call_id, name=name, arguments=arguments)
+            self.tool_turn_end = turn_end
+        except asyncio.CancelledError:
+            status = 'cancelled'
+        try:
+            await self.emit('response.done', response={
+                "id": response_id, "status": status, "output": [item] if status == 'completed' else [],
+                "usage": {"total_tokens": input_tokens, "input_tokens": input_tokens, "output_tokens": 0},
+            })
+            self.rate_limiter.record(input_tokens)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def cancel_response(self):
+        if self.responding:
+            self.response_task.cancel()
+            self.response_task = None
+
+    async def respond(self, delay_ms):
+        config = self.config
+        response_id = self.new_id('resp')
+        item_id = self.new_id('item')
+        fmt = self.session.get('output_audio_format', 'pcm16')
+        chunk = SILENCE_BYTE[fmt] * (BYTES_PER_MS[fmt] * config.delta_ms - TIMESTAMP.size)
+        status = 'completed'
+        # An answer that follows a tool result answers the caller turn that asked for the tool
+        turn_end, self.tool_turn_end = self.tool_turn_end or time.time(), None
+        input_tokens = self.context_tokens()
+        output_tokens = 0
+        # Longer conversations take longer to answer
+        delay_ms += config.context_latency_ms * input_tokens / 1000
+        try:
+            await asyncio.sleep(delay_ms / 1000)
+            await self.emit('response.created', response={"id": response_id, "status": "in_progress"})
+            item = {"id": item_id, "type": "message", "role": "assistant",
+                    "content": [{"type": "audio", "transcript": ""}]}
+            await self.emit('response.output_item.added', response_id=response_id, output_index=0, item=item)
+            await self.add_item(item)
+            for _ in range(max(1, config.response_ms // config.delta_ms)):
+                audio = TIMESTAMP.pack(time.time(), turn_end) + chunk
+                await self.emit('response.audio.delta', response_id=response_id, item_id=item_id,
+                                output_index=0, content_index=0,
+                                delta=base64.b64encode(audio).decode('ascii'))
+                # Output audio costs about one token per 50 ms
+                output_tokens += config.delta_ms // 50
+                if config.audio_rate > 0:
+                    await asyncio.sleep(config.delta_ms / 1000 / config.audio_rate)
+            transcript = "This is a simulated assistant response."
+            item['content'][0]['transcript'] = transcript
+            await self.emit('response.audio.done', response_id=response_id, item_id=item_id,
+                            output_index=0, content_index=0)
+            await self.emit('response.audio_transcript.done', response_id=response_id, item_id=item_id,
+                            output_index=0, content_index=0, transcript=transcript)
+        except asyncio.CancelledError:
+            status = 'cancelled'
+        if item_id in self.tokens:
+            self.tokens[item_id] += output_tokens
+        try:
+            await self.emit('response.done', response={
+                "id": response_id, "status": status,
+                "output": [{"id": item_id, "type": "message", "role": "assistant"}],
+                "usage": {"total_tokens": input_tokens + output_tokens, "input_tokens": input_tokens,
+                          "output_tokens": output_tokens},
+            })
+            self.rate_limiter.record(input_tokens + output_tokens)
+            await self.emit('rate_limits.updated', rate_limits=self.rate_limiter.rate_limits(self.config))
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def serve(config, host='localhost', port=8765):
+    """Start the mock server; returns the websockets server object."""
+    rate_limiter = RateLimiter()
+
+    async def handler(ws):
+        await MockSession(ws, config, rate_limiter).run()
+    return await websockets.serve(handler, host, port, max_size=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the OpenAI Realtime API.")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    defaults = MockConfig()
+    for name, value in vars(defaults).items():
+        parser.add_argument('--' + name.replace('_', '-'), type=type(value), default=value)
+    args = parser.parse_args()
+    config = MockConfig(**{name: getattr(args, name) for name in vars(defaults)})
+
+    async def run():
+        await serve(config, args.host, args.port)
+        print(f"Mock Realtime API listening on ws://{args.host}:{args.port}")
+        await asyncio.Future()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
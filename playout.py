@@ -0,0 +1,95 @@
+"""Pacing and playback tracking for assistant audio sent to Twilio.
+
+OpenAI streams `response.audio.delta` several times faster than real
+time. Forwarding it as it arrives piles seconds of unplayed audio up in
+Twilio's buffer, which then has to be cleared on barge-in, and leaves
+no way to tell how much of it the caller actually heard. `Playout`
+models the caller's playback position instead: every write to Twilio
+extends a playback clock at 8 bytes/ms, the outbound pump holds audio
+back until it is within `lead_ms` of being played, and each acknowledged
+`mark` re-anchors the clock to the position Twilio confirmed. Barge-in
+then clears at most `lead_ms` of audio at Twilio and truncates the
+assistant item at the millisecond the caller stopped hearing it.
+"""
+from collections import deque
+
+import metrics
+import relay
+
+UNPLAYED_AT_CLEAR = metrics.Histogram(
+    'relay_barge_in_unplayed_seconds',
+    'Assistant audio already sent to Twilio but not yet played when the caller interrupted.',
+    buckets=metrics.LATENCY_BUCKETS)
+
+
+class Playout:
+    """Playback clock for one call's outbound audio; the pacer for its Twilio pump.
+
+    Positions are milliseconds of audio written to Twilio since the call
+    started. `mark_sent()` records the position at which a mark was
+    written and `mark_played()` moves the clock to it when Twilio echoes
+    the mark back. `start_item()` records where an assistant item's audio
+    begins so `item_played_ms()` can give its truncation point.
+    """
+
+    def __init__(self, lead_ms=300, bytes_per_ms=8):
+        self.lead = lead_ms / 1000
+        self.bytes_per_ms = bytes_per_ms
+        self.sent_ms = 0.0
+        self._play_end = 0.0       # perf_counter() when everything sent so far has played
+        self._marks = deque()      # (name, sent_ms when the mark was written)
+        self._item_id = None
+        self._item_start_ms = 0.0
+
+    def delay(self, now):
+        """Seconds to hold the next audio write so at most `lead_ms` is buffered at Twilio."""
+        if self.lead <= 0:
+            return 0
+        return self._play_end - now - self.lead
+
+    def sent(self, payload, now):
+        """Advance the clock for audio written to Twilio."""
+        ms = relay.decoded_size(payload) / self.bytes_per_ms
+        self.sent_ms += ms
+        self._play_end = max(self._play_end, now) + ms / 1000
+
+    def unplayed_ms(self, now):
+        return max(0.0, self._play_end - now) * 1000
+
+    def played_ms(self, now):
+        return self.sent_ms - self.unplayed_ms(now)
+
+    def busy(self, now):
+        """True while Twilio may still be playing, or has unacknowledged marks."""
+        return bool(self._marks) or self._play_end > now
+
+    def start_item(self, item_id):
+        self._item_id = item_id
+        self._item_start_ms = self.sent_ms
+
+    def item_played_ms(self, item_id, now):
+        """Milliseconds of `item_id`'s audio the caller has heard (0 if none was written yet)."""
+        if item_id != self._item_id:
+            return 0
+        return max(0, int(self.played_ms(now) - self._item_start_ms))
+
+    def mark_sent(self, name):
+        self._marks.append((name, self.sent_ms))
+
+    def mark_played(self, name, now):
+        """Twilio echoed mark `name`: everything before it has played."""
+        if not any(pending == name for pending, _ in self._marks):
+            return  # a mark from before the last clear
+        while True:
+            pending, position = self._marks.popleft()
+            if pending == name:
+                break
+        self._play_end = now + (self.sent_ms - position) / 1000
+
+    def clear(self, now):
+        """The caller interrupted: Twilio drops its buffer and stops playing."""
+        UNPLAYED_AT_CLEAR.observe(self.unplayed_ms(now) / 1000)
+        self.sent_ms = self.played_ms(now)
+        self._play_end = now
+        self._marks.clear()
+        self._item_id = None
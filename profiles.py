@@ -0,0 +1,221 @@
+"""Session profiles: the voice, prompt and greeting of each phone number or route.
+
+A profile bundles what a caller hears: the Realtime voice, instructions
+and temperature, the greeting the assistant opens with, and the TwiML
+messages around the call. `ProfileRegistry` builds the built-in
+`default` profile from the server's settings, plus any profiles in
+PROFILES_FILE (JSON):
+
+    {"profiles": {
+        "sales": {"voice": "verse", "instructions": "...", "greeting": "...",
+                  "numbers": ["+15550100"]},
+        "support": {"instructions": "...", "greeting": null}
+    }}
+
+Fields left out are taken from `default`, which the file may also
+override. A `greeting` of null lets the caller speak first.
+
+Every profile is validated and compiled when it is loaded: its
+`session.update` for each audio format, the greeting request, and the
+TwiML prefix, hold and busy responses are rendered to strings once.
+A call picks its profile with one dictionary lookup, by explicit name
+(the route) or by the number that was dialled, and sends those strings
+as they are. The file is re-read when it changes (`reload_if_changed`);
+a file that doesn't validate is reported and the profiles already
+loaded stay in use. Calls keep the profile they started with.
+"""
+import json
+import os
+import re
+
+from twilio.twiml.voice_response import VoiceResponse
+
+import audio_codec
+
+DEFAULT = 'default'
+VOICES = frozenset(('alloy', 'ash', 'ballad', 'coral', 'echo', 'sage', 'shimmer', 'verse'))
+# The Realtime API accepts temperatures in this range
+TEMPERATURES = (0.6, 1.2)
+# Profile names appear in stream URLs and hold redirects
+NAME = re.compile(r'[A-Za-z0-9_-]+$')
+FIELDS = frozenset(('voice', 'instructions', 'temperature', 'greeting', 'intro', 'hold_message',
+                    'busy_message', 'numbers'))
+
+
+class ProfileError(ValueError):
+    """A profile definition is invalid."""
+
+
+class Profile:
+    """One validated profile and its pre-serialized payloads.
+
+    `session` holds settings shared by every profile (caller
+    transcription, tools) that are merged into each `session.update`;
+    `hold_seconds` is the pause between checks for callers on hold.
+    """
+
+    def __init__(self, name, settings, session=None, hold_seconds=5):
+        self.name = name
+        self.voice = settings['voice']
+        self.instructions = settings['instructions']
+        self.temperature = settings['temperature']
+        self.greeting = settings['greeting']
+        self.numbers = tuple(settings.get('numbers', ()))
+        self._session_updates = {}
+        for audio_format in audio_codec.FORMATS:
+            self._session_updates[audio_format] = json.dumps({
+                "type": "session.update",
+                "session": dict({
+                    "turn_detection": {"type": "server_vad"},
+                    "input_audio_format": audio_format,
+                    "output_audio_format": audio_format,
+                    "voice": self.voice,
+                    "instructions": self.instructions,
+                    "modalities": ["text", "audio"],
+                    "temperature": self.temperature,
+                }, **(session or {})),
+            })
+        self.greeting_request = None
+        if self.greeting:
+            self.greeting_request = json.dumps({
+                "type": "conversation.item.create",
+                "item": {
+                    "type": "message",
+                    "role": "user",
+                    "content": [{"type": "input_text", "text": f"Greet the user with '{self.greeting}'"}],
+                },
+            })
+
+        # Non-default profiles are named in hold redirects so they survive the round trip
+        redirect = '/incoming-call?held=1' if name == DEFAULT else f'/incoming-call?held=1&profile={name}'
+        response = VoiceResponse()
+        for index, line in enumerate(settings['intro']):
+            if index:
+                response.pause(length=1)
+            response.say(line)
+        self.twiml_prefix = str(response)[:-len('</Response>')]
+        # Callers on hold hear the message the first time only
+        response = VoiceResponse()
+        response.say(settings['hold_message'])
+        response.pause(length=hold_seconds)
+        response.redirect(redirect)
+        self.hold_twiml = str(response)
+        response = VoiceResponse()
+        response.pause(length=hold_seconds)
+        response.redirect(redirect)
+        self.held_twiml = str(response)
+        response = VoiceResponse()
+        response.say(settings['busy_message'])
+        response.hangup()
+        self.busy_twiml = str(response)
+
+    def session_update(self, audio_format):
+        """The `session.update` message for a session in `audio_format`."""
+        return self._session_updates[audio_format]
+
+    def connect_twiml(self, connect):
+        """The intro followed by `connect` (a TwiML <Connect>)."""
+        return f'{self.twiml_prefix}{connect.to_xml(xml_declaration=False)}</Response>'
+
+
+def validate(name, settings):
+    """Check one merged profile definition; raises ProfileError."""
+    unknown = set(settings) - FIELDS
+    if unknown:
+        raise ProfileError(f"profile {name!r}: unknown fields {', '.join(sorted(unknown))}")
+    if not isinstance(settings['voice'], str) or settings['voice'] not in VOICES:
+        raise ProfileError(f"profile {name!r}: voice must be one of {', '.join(sorted(VOICES))}")
+    if not isinstance(settings['instructions'], str) or not settings['instructions'].strip():
+        raise ProfileError(f"profile {name!r}: instructions must be a non-empty string")
+    temperature = settings['temperature']
+    if (not isinstance(temperature, (int, float)) or isinstance(temperature, bool)
+            or not TEMPERATURES[0] <= temperature <= TEMPERATURES[1]):
+        raise ProfileError(f"profile {name!r}: temperature must be between {TEMPERATURES[0]} and {TEMPERATURES[1]}")
+    if settings['greeting'] is not None and not isinstance(settings['greeting'], str):
+        raise ProfileError(f"profile {name!r}: greeting must be a string or null")
+    if not isinstance(settings['intro'], list) or not all(isinstance(line, str) for line in settings['intro']):
+        raise ProfileError(f"profile {name!r}: intro must be a list of strings")
+    for field in ('hold_message', 'busy_message'):
+        if not isinstance(settings[field], str):
+            raise ProfileError(f"profile {name!r}: {field} must be a string")
+    numbers = settings.get('numbers', [])
+    if not isinstance(numbers, list) or not all(isinstance(number, str) for number in numbers):
+        raise ProfileError(f"profile {name!r}: numbers must be a list of phone numbers")
+
+
+class ProfileRegistry:
+    """The loaded profiles, by name and by phone number.
+
+    `defaults` holds the built-in default profile's fields; `session`
+    the settings merged into every `session.update`; `hold_seconds` the
+    pause in hold responses.
+    """
+
+    def __init__(self, defaults, path=None, session=None, hold_seconds=5):
+        self.defaults = defaults
+        self.path = path
+        self.session = session or {}
+        self.hold_seconds = hold_seconds
+        self._mtime = None
+        self._by_name, self._by_number = self._build({})
+        if path:
+            self.reload()
+
+    @property
+    def default(self):
+        return self._by_name[DEFAULT]
+
+    def lookup(self, name=None, number=None):
+        """The profile called `name`, else the one for dialled `number`, else the default."""
+        return self._by_name.get(name) or self._by_number.get(number) or self._by_name[DEFAULT]
+
+    def names(self):
+        return list(self._by_name)
+
+    def reload(self):
+        """Load PROFILES_FILE again; raises OSError or ProfileError and keeps the old profiles if it fails."""
+        # A broken file is reported once, not again until it changes
+        self._mtime = os.stat(self.path).st_mtime
+        with open(self.path, encoding='utf-8') as f:
+            try:
+                document = json.load(f)
+            except ValueError as e:
+                raise ProfileError(f"{self.path}: {e}") from e
+        if not isinstance(document, dict) or not isinstance(document.get('profiles'), dict):
+            raise ProfileError(f"{self.path}: expected an object with a \"profiles\" object")
+        # Swapped in one assignment, so a lookup sees either the old profiles or the new ones
+        self._by_name, self._by_number = self._build(document['profiles'])
+
+    def reload_if_changed(self):
+        """Reload if PROFILES_FILE was modified since it was last loaded; returns whether it was."""
+        if not self.path:
+            return False
+        try:
+            changed = os.stat(self.path).st_mtime != self._mtime
+        except OSError:
+            return False
+        if changed:
+            self.reload()
+        return changed
+
+    def _build(self, definitions):
+        definitions = dict(definitions, **{DEFAULT: definitions.get(DEFAULT, {})})
+        for name, definition in definitions.items():
+            if not NAME.match(name):
+                raise ProfileError(f"profile name {name!r} may only contain letters, digits, _ and -")
+            if not isinstance(definition, dict):
+                raise ProfileError(f"profile {name!r} must be an object")
+        base = dict(self.defaults, **definitions[DEFAULT])
+        by_name, by_number = {}, {}
+        for name, definition in definitions.items():
+            settings = dict(base)
+            if name != DEFAULT:
+                settings['numbers'] = []  # numbers are the one field not inherited
+            settings.update(definition)
+            validate(name, settings)
+            profile = by_name[name] = Profile(name, settings, self.session, self.hold_seconds)
+            for number in profile.numbers:
+                if number in by_number:
+                    raise ProfileError(f"number {number} is in both {by_number[number].name!r} and {name!r}")
+                by_number[number] = profile
+        return by_name, by_number
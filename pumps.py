@@ -0,0 +1,184 @@
+"""Bounded, backpressure-aware message pumps between the caller and OpenAI.
+
+Each direction of a call gets a `Pump`: readers enqueue without
+awaiting the other socket, and a dedicated writer task drains the queue.
+A slow peer therefore only delays its own direction. When a queue hits
+its bounds, audio is merged or dropped according to the pump's policy;
+control messages (marks, clears, truncates) are never dropped.
+`run_until_first_exits` runs a call's tasks and cancels the siblings as
+soon as one of them ends or fails, so a dead socket cannot leave the
+other side hanging.
+"""
+import asyncio
+import base64
+import time
+from collections import deque
+
+import metrics
+
+# Overflow policies for audio.
+DROP_OLDEST = 'drop_oldest'   # discard the oldest queued audio (assistant audio to the caller)
+MERGE = 'merge'               # concatenate queued audio into fewer messages (caller audio to OpenAI)
+
+QUEUE_DEPTH = metrics.Gauge('relay_pump_queue_depth', 'Messages waiting in relay pumps, across calls.',
+                            ['transport', 'direction'])
+QUEUE_DROPPED_BYTES = metrics.Counter('relay_pump_dropped_bytes_total',
+                                      'Base64 audio bytes dropped because a peer fell behind.',
+                                      ['transport', 'direction'])
+QUEUE_MERGED = metrics.Counter('relay_pump_merged_total',
+                               'Queued audio messages merged because a peer fell behind.',
+                               ['transport', 'direction'])
+
+
+class _Item:
+    __slots__ = ('audio', 'payload', 'received_at', 'on_sent')
+
+    def __init__(self, audio, payload, received_at=None, on_sent=None):
+        self.audio = audio
+        self.payload = payload
+        self.received_at = received_at
+        self.on_sent = on_sent
+
+
+class Pump:
+    """One direction of a call: a bounded queue and the writer that drains it.
+
+    `send` is the destination socket's send coroutine. Audio is queued as
+    base64 payloads and turned into a message by `frame_audio` only when
+    it is written, so merging never has to re-parse JSON. `on_audio_sent`
+    is called with `(payload, received_at)` after each audio write.
+
+    An optional `pacer` (see playout.py) holds audio back: its
+    `delay(now)` gives the seconds to wait before the next audio write and
+    `sent(payload, now)` is told about each one. Time spent waiting on the
+    pacer is deliberate and is not counted as relay delay. A paced queue
+    is expected to hold a whole answer interleaved with its marks, so it is
+    bounded by `max_audio_bytes` only.
+    """
+
+    def __init__(self, send, transport, direction, frame_audio, on_audio_sent=None,
+                 policy=DROP_OLDEST, max_messages=256, max_audio_bytes=1 << 20, pacer=None):
+        self.send = send
+        self.frame_audio = frame_audio
+        self.on_audio_sent = on_audio_sent
+        self.policy = policy
+        self.max_messages = max_messages
+        self.max_audio_bytes = max_audio_bytes
+        self.pacer = pacer
+        self._released_at = 0.0
+        self._queue = deque()
+        self._audio_bytes = 0
+        self._wakeup = asyncio.Event()
+        self._depth = QUEUE_DEPTH.labels(transport, direction)
+        self._dropped = QUEUE_DROPPED_BYTES.labels(transport, direction)
+        self._merged = QUEUE_MERGED.labels(transport, direction)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put_audio(self, payload, received_at, on_sent=None):
+        """Queue a base64 audio payload, applying the overflow policy if full.
+
+        `on_sent()` runs once the payload is written, before the pacer counts it.
+        """
+        self._audio_bytes += len(payload)
+        self._append(_Item(True, payload, received_at, on_sent))
+        while ((self.pacer is None and len(self._queue) > self.max_messages)
+               or self._audio_bytes > self.max_audio_bytes):
+            if not self._relieve():
+                break
+
+    def put_control(self, message, on_sent=None):
+        """Queue a message that must be delivered; `on_sent()` runs once it is written."""
+        self._append(_Item(False, message, on_sent=on_sent))
+
+    def clear(self):
+        """Drop everything still queued, e.g. unsent assistant audio on barge-in."""
+        self._depth.dec(len(self._queue))
+        self._queue.clear()
+        self._audio_bytes = 0
+
+    def _append(self, item):
+        self._queue.append(item)
+        self._depth.inc()
+        self._wakeup.set()
+
+    def _relieve(self):
+        """Shrink the queue once according to the policy; False if nothing can go."""
+        queue = self._queue
+        if self.policy == MERGE and len(queue) > self.max_messages:
+            for index in range(len(queue) - 1):
+                first, second = queue[index], queue[index + 1]
+                if first.audio and second.audio and second.on_sent is None:
+                    audio = base64.b64decode(first.payload) + base64.b64decode(second.payload)
+                    merged = base64.b64encode(audio).decode('ascii')
+                    self._audio_bytes += len(merged) - len(first.payload) - len(second.payload)
+                    first.payload = merged
+                    del queue[index + 1]
+                    self._depth.dec()
+                    self._merged.inc()
+                    return True
+        for index, item in enumerate(queue):
+            if item.audio:
+                del queue[index]
+                self._depth.dec()
+                self._audio_bytes -= len(item.payload)
+                self._dropped.inc(len(item.payload))
+                return True
+        return False
+
+    async def run(self):
+        """Writer task: deliver queued messages in order until cancelled."""
+        queue = self._queue
+        while True:
+            if not queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self.pacer is not None and queue[0].audio:
+                delay = self.pacer.delay(time.perf_counter())
+                if delay > 0:
+                    # Wait for the pacer, but wake up for anything queued meanwhile: a clear
+                    # on barge-in replaces the queued audio and must go out at once
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        self._released_at = time.perf_counter()
+                    continue
+            item = queue.popleft()
+            self._depth.dec()
+            if item.audio:
+                self._audio_bytes -= len(item.payload)
+                await self.send(self.frame_audio(item.payload))
+                if item.on_sent is not None:
+                    item.on_sent()
+                if self.pacer is not None:
+                    self.pacer.sent(item.payload, time.perf_counter())
+                if self.on_audio_sent is not None:
+                    self.on_audio_sent(item.payload, max(item.received_at, self._released_at))
+            else:
+                await self.send(item.payload)
+                if item.on_sent is not None:
+                    item.on_sent()
+
+    def close(self):
+        """Release this pump's share of the queue-depth gauge."""
+        self.clear()
+
+
+async def run_until_first_exits(*coroutines):
+    """Run a call's tasks until any of them returns or fails, then cancel the rest.
+
+    Re-raises the first exception raised by a task that finished on its own.
+    """
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        if not task.cancelled() and task.exception() is not None:
+            raise task.exception()
@@ -0,0 +1,167 @@
+"""Pool of pre-connected, pre-configured OpenAI Realtime sessions.
+
+Opening the Realtime WebSocket (DNS, TLS, HTTP upgrade) and configuring
+the session costs a noticeable chunk of dead air at the start of a call.
+`RealtimePool` keeps a few sessions connected and initialized ahead of
+time, hands one out instantly per call and refills in the background.
+Sessions are dropped before they get too close to the server-side
+expiry so a call never inherits a nearly expired session.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import websockets
+
+import eventlog
+import metrics
+
+# Realtime sessions expire this long after creation unless session.created says otherwise.
+DEFAULT_SESSION_LIFETIME = 30 * 60
+# Calls announced by /incoming-call stop counting towards the target after this long.
+WARM_REQUEST_TTL = 30
+
+POOL_IDLE = metrics.Gauge('realtime_pool_idle_sessions', 'Warm Realtime sessions waiting for a call.')
+POOL_ACQUIRED = metrics.Counter('realtime_pool_acquired_total',
+                                'Sessions handed to calls, by whether one was already warm.', ['result'])
+POOL_CONNECT = metrics.Histogram('realtime_pool_connect_seconds',
+                                 'Time to connect and initialize one Realtime session.')
+
+
+class _PooledSession:
+    __slots__ = ('ws', 'expires_at')
+
+    def __init__(self, ws, expires_at):
+        self.ws = ws
+        self.expires_at = expires_at
+
+
+class RealtimePool:
+    """Keep `size` initialized Realtime sessions ready for incoming calls.
+
+    `initialize` is awaited with each new connection (typically sending
+    `session.update`) before it is pooled. Sessions with less than
+    `min_remaining` seconds left before expiry are closed instead of
+    being handed out.
+    """
+
+    def __init__(self, url, headers, initialize, size=2, min_remaining=25 * 60):
+        self.url = url
+        self.headers = headers
+        self.initialize = initialize
+        self.size = size
+        self.min_remaining = min_remaining
+        self._idle = deque()
+        self._connecting = 0
+        self._warm_requests = deque()
+        self._changed = asyncio.Event()
+        self._refill_task = None
+
+    async def connect(self):
+        """Open and initialize one Realtime session."""
+        started = time.perf_counter()
+        ws = await websockets.connect(self.url, extra_headers=self.headers)
+        expires_at = time.time() + DEFAULT_SESSION_LIFETIME
+        try:
+            # The server always opens with session.created, which carries the expiry.
+            created = json.loads(await ws.recv())
+            if created.get('type') == 'session.created':
+                expires_at = created['session'].get('expires_at') or expires_at
+            await self.initialize(ws)
+        except BaseException:
+            await ws.close()
+            raise
+        POOL_CONNECT.observe(time.perf_counter() - started)
+        return _PooledSession(ws, expires_at)
+
+    def start(self):
+        """Start filling the pool in the background."""
+        if self.size > 0 and self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def close(self):
+        if self._refill_task:
+            self._refill_task.cancel()
+            self._refill_task = None
+        while self._idle:
+            await self._idle.pop().ws.close()
+        POOL_IDLE.set(0)
+
+    def warm(self):
+        """Announce an imminent call so an extra session starts connecting now."""
+        self._warm_requests.append(time.monotonic())
+        self._changed.set()
+
+    def refresh(self):
+        """Close the idle sessions, so the pool refills with what `initialize` sends now."""
+        while self._idle:
+            asyncio.create_task(self._idle.pop().ws.close())
+        POOL_IDLE.set(0)
+        self._changed.set()
+
+    def _usable(self, session):
+        return session.ws.open and session.expires_at - time.time() > self.min_remaining
+
+    async def acquire(self):
+        """Return an initialized session, connecting one on demand if none are warm."""
+        if self._warm_requests:
+            self._warm_requests.popleft()
+        ws = None
+        while self._idle:
+            session = self._idle.pop()  # newest first: most session lifetime left
+            if self._usable(session):
+                ws = session.ws
+                break
+            await session.ws.close()
+        POOL_IDLE.set(len(self._idle))
+        self._changed.set()
+        if ws is not None:
+            POOL_ACQUIRED.labels('warm').inc()
+            return ws
+        POOL_ACQUIRED.labels('cold').inc()
+        return (await self.connect()).ws
+
+    @asynccontextmanager
+    async def session(self):
+        """Context manager form of `acquire` that closes the session on exit."""
+        ws = await self.acquire()
+        try:
+            yield ws
+        finally:
+            await ws.close()
+
+    def _target(self):
+        now = time.monotonic()
+        while self._warm_requests and now - self._warm_requests[0] > WARM_REQUEST_TTL:
+            self._warm_requests.popleft()
+        return self.size + len(self._warm_requests)
+
+    async def _refill(self):
+        while True:
+            self._changed.clear()
+            for session in [s for s in self._idle if not self._usable(s)]:
+                self._idle.remove(session)
+                asyncio.create_task(session.ws.close())
+            POOL_IDLE.set(len(self._idle))
+            for _ in range(self._target() - len(self._idle) - self._connecting):
+                self._connecting += 1
+                asyncio.create_task(self._add_one())
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _add_one(self):
+        try:
+            session = await self.connect()
+        except Exception as e:
+            eventlog.warning('pool.connect_failed', "Realtime pool failed to connect: %s", e)
+            await asyncio.sleep(1)  # back off before the refill loop retries
+        else:
+            self._idle.append(session)
+            POOL_IDLE.set(len(self._idle))
+        finally:
+            self._connecting -= 1
+            self._changed.set()
@@ -0,0 +1,266 @@
+"""Opt-in call recording and transcripts, written off the relay's hot path.
+
+Each call gets a `CallRecorder` holding a fixed-size buffer of caller
+audio, assistant audio and transcript events. The relay only appends to
+it: audio stays base64 as it arrived and nothing touches the disk.
+A single `RecordingWriter` thread drains every buffer a few times a
+second into `<call id>-caller.wav`, `<call id>-assistant.wav` and
+`<call id>.jsonl`.
+
+Both tracks are aligned to the call's wall clock: when a track falls
+behind (the caller muted, the assistant between turns, or audio was
+dropped), the writer pads it with silence, so the two files line up
+when played side by side. If the disk falls behind and a call's buffer
+fills, the oldest unwritten entries are overwritten. Those bytes are
+counted in `relay_recording_dropped_bytes_total` and in the final line
+of the call's transcript, and the call itself never waits.
+"""
+import base64
+import json
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+import audio_codec
+import eventlog
+import metrics
+import relay
+
+CALLER = 'caller'
+ASSISTANT = 'assistant'
+TRACKS = (CALLER, ASSISTANT)
+
+RECORDED_BYTES = metrics.Counter('relay_recording_bytes_total', 'Audio bytes written to call recordings.',
+                                 ['track'])
+DROPPED_BYTES = metrics.Counter('relay_recording_dropped_bytes_total',
+                                'Recording bytes dropped because the writer fell behind.', ['track'])
+ACTIVE_RECORDINGS = metrics.Gauge('relay_recordings_active', 'Calls currently being recorded.')
+
+# WAV format tags
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_MULAW = 7
+WAVE_FORMAT_ALAW = 6
+_WAV_FORMATS = {'pcm16': (WAVE_FORMAT_PCM, 2), 'ulaw': (WAVE_FORMAT_MULAW, 1), 'alaw': (WAVE_FORMAT_ALAW, 1)}
+_SILENCE = {'pcm16': b'\x00\x00', 'ulaw': b'\xff', 'alaw': b'\xd5'}
+# Tracks less than this far behind the wall clock are not padded, to absorb network jitter.
+_PAD_THRESHOLD = 0.1
+_TEXT_ENTRY_SIZE = 128  # rough buffer cost of a transcript entry on top of its text
+
+
+class _WavFile:
+    """A WAV file whose header sizes are patched in when it is closed."""
+
+    def __init__(self, path, encoding, rate):
+        tag, width = _WAV_FORMATS[encoding]
+        self.file = open(path, 'wb')
+        self.width = width
+        self.rate = rate
+        self.silence = _SILENCE[encoding]
+        self.size = 0
+        self.file.write(b'RIFF' + struct.pack('<I', 0) + b'WAVE')
+        self.file.write(b'fmt ' + struct.pack('<IHHIIHH', 16, tag, 1, rate, rate * width, width, width * 8))
+        self.file.write(b'data' + struct.pack('<I', 0))
+
+    @property
+    def seconds(self):
+        return self.size / (self.rate * self.width)
+
+    def write(self, audio):
+        self.file.write(audio)
+        self.size += len(audio)
+
+    def pad_to(self, seconds):
+        """Append silence up to `seconds` into the track."""
+        missing = int((seconds - self.seconds) * self.rate) * self.width
+        if missing > 0:
+            self.write(self.silence * (missing // len(self.silence)))
+
+    def close(self):
+        try:
+            self.file.seek(4)
+            self.file.write(struct.pack('<I', 36 + self.size))
+            self.file.seek(40)
+            self.file.write(struct.pack('<I', self.size))
+        finally:
+            self.file.close()
+
+
+class CallRecorder:
+    """Bounded buffer of one call's recording; the relay appends, the writer drains.
+
+    `audio_format` names the Realtime format of both tracks (as in
+    audio_codec.FORMATS), and `rate` overrides its sample rate for legs
+    that use another one.
+    """
+
+    def __init__(self, writer, call_id, audio_format, rate=None, capacity=1 << 20):
+        self.writer = writer
+        self.call_id = call_id
+        self.encoding, default_rate = audio_codec.FORMATS[audio_format]
+        self.rate = rate or default_rate
+        self.capacity = capacity
+        self.started_at = time.perf_counter()
+        self.started_wall = time.time()
+        self.dropped = dict.fromkeys(TRACKS + ('text',), 0)
+        self.closed = False
+        self._entries = deque()
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._dropped_metrics = {track: DROPPED_BYTES.labels(track) for track in TRACKS + ('text',)}
+        # Writer-side state
+        self.files = None
+
+    def audio(self, track, payload):
+        """Buffer base64 `payload` (or raw bytes) for `track`."""
+        self._add(track, payload, relay.decoded_size(payload) if isinstance(payload, str) else len(payload))
+
+    def transcript(self, role, text, **fields):
+        """Buffer one transcript line."""
+        fields.update(role=role, text=text)
+        self._add('text', fields, len(text) + _TEXT_ENTRY_SIZE)
+
+    def event(self, name, **fields):
+        """Buffer a call event (interruptions, stream start) for the transcript."""
+        fields['event'] = name
+        self._add('text', fields, _TEXT_ENTRY_SIZE)
+
+    def _add(self, kind, data, size):
+        entry = (kind, time.perf_counter() - self.started_at, data, size)
+        with self._lock:
+            self._entries.append(entry)
+            self._buffered += size
+            while self._buffered > self.capacity:
+                dropped_kind, _, _, dropped_size = self._entries.popleft()
+                self._buffered -= dropped_size
+                self.dropped[dropped_kind] += dropped_size
+                self._dropped_metrics[dropped_kind].inc(dropped_size)
+
+    def close(self):
+        """The call ended; the writer flushes what is left and closes the files."""
+        self.event('end')
+        self.closed = True
+        self.writer.wake()
+
+    def drain(self):
+        """Take everything buffered so far (called by the writer)."""
+        with self._lock:
+            entries, self._entries = self._entries, deque()
+            self._buffered = 0
+        return entries
+
+
+class RecordingWriter:
+    """Background thread that writes every open call's buffer to disk."""
+
+    def __init__(self, directory, buffer_bytes=1 << 20, interval=0.25):
+        self.directory = directory
+        self.buffer_bytes = buffer_bytes
+        self.interval = interval
+        self._recorders = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='recording-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush and close every recording, then stop the thread."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def open(self, call_id, audio_format, rate=None):
+        recorder = CallRecorder(self, call_id, audio_format, rate, self.buffer_bytes)
+        with self._lock:
+            self._recorders.append(recorder)
+        ACTIVE_RECORDINGS.inc()
+        return recorder
+
+    def _run(self):
+        while True:
+            stopping = self._stopping
+            with self._lock:
+                recorders = list(self._recorders)
+            for recorder in recorders:
+                try:
+                    self._flush(recorder, final=recorder.closed or stopping)
+                except OSError as e:
+                    eventlog.error('recording.error', "Recording %s failed: %s", recorder.call_id, e)
+                    self._close_files(recorder)
+                    self._forget(recorder)
+            if stopping:
+                return
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _flush(self, recorder, final):
+        if recorder.files is None:
+            recorder.files = self._open_files(recorder)
+        wavs, transcript = recorder.files
+        for kind, at, data, size in recorder.drain():
+            if kind == 'text':
+                data['t'] = round(at, 3)
+                transcript.write(json.dumps(data) + '\n')
+                continue
+            audio = base64.b64decode(data) if isinstance(data, str) else data
+            wav = wavs[kind]
+            if at - wav.seconds > _PAD_THRESHOLD:
+                wav.pad_to(at)
+            wav.write(audio)
+            RECORDED_BYTES.labels(kind).inc(len(audio))
+        if final:
+            end = time.perf_counter() - recorder.started_at
+            for wav in wavs.values():
+                wav.pad_to(end)
+                wav.close()
+            transcript.write(json.dumps({'event': 'summary', 'duration': round(end, 3),
+                                         'dropped_bytes': recorder.dropped}) + '\n')
+            transcript.close()
+            self._forget(recorder)
+        else:
+            transcript.flush()
+
+    def _open_files(self, recorder):
+        prefix = os.path.join(self.directory, recorder.call_id)
+        # Filled in as files open, so a failure part way closes the ones already open
+        wavs = {}
+        recorder.files = wavs, None
+        for track in TRACKS:
+            wavs[track] = _WavFile(f'{prefix}-{track}.wav', recorder.encoding, recorder.rate)
+        transcript = open(f'{prefix}.jsonl', 'w', encoding='utf-8')
+        recorder.files = wavs, transcript
+        transcript.write(json.dumps({'event': 'start', 'call_id': recorder.call_id,
+                                     'started': recorder.started_wall, 'format': recorder.encoding,
+                                     'sample_rate': recorder.rate}) + '\n')
+        return wavs, transcript
+
+    def _close_files(self, recorder):
+        """Close a failed recording's files, fixing up the WAV headers if the disk still allows it."""
+        if recorder.files is None:
+            return
+        wavs, transcript = recorder.files
+        for file in list(wavs.values()) + [transcript]:
+            if file is None:
+                continue
+            try:
+                file.close()
+            except OSError:
+                pass
+
+    def _forget(self, recorder):
+        with self._lock:
+            if recorder in self._recorders:
+                self._recorders.remove(recorder)
+                ACTIVE_RECORDINGS.dec()
@@ -0,0 +1,148 @@
+"""Fast-path helpers for relaying Realtime API audio to Twilio.
+
+The OpenAI -> Twilio direction is dominated by `response.audio.delta`
+events. Those only need their `delta` (already base64 g711_ulaw, exactly
+what Twilio expects) and `item_id` copied into a Twilio media frame, so
+the helpers here classify and slice the raw message text instead of
+parsing, decoding, re-encoding and re-serializing every frame.
+`AudioCoalescer` batches the other direction, caller audio to OpenAI.
+"""
+import base64
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib codec
+    orjson = None
+
+AUDIO_DELTA = 'response.audio.delta'
+
+_TYPE_KEY = '"type":'
+_DELTA_KEY = '"delta":'
+_ITEM_ID_KEY = '"item_id":'
+# Realtime events put "type" first; only look that far before falling back.
+_TYPE_SEARCH_LIMIT = 64
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj):
+        """Serialize `obj` to a compact JSON string."""
+        return orjson.dumps(obj).decode('utf-8')
+else:
+    loads = json.loads
+
+    def dumps(obj):
+        """Serialize `obj` to a compact JSON string."""
+        return json.dumps(obj, separators=(',', ':'))
+
+
+def _string_field(message, key, start=0, stop=None):
+    """Slice the raw string value following `key`, or None if not plain."""
+    pos = message.find(key, start) if stop is None else message.find(key, start, stop)
+    if pos < 0:
+        return None
+    pos += len(key)
+    while message[pos:pos + 1] == ' ':
+        pos += 1
+    if message[pos:pos + 1] != '"':
+        return None
+    pos += 1
+    end = message.find('"', pos)
+    if end < 0:
+        return None
+    value = message[pos:end]
+    if '\\' in value:
+        return None
+    return value
+
+
+def event_type(message):
+    """Return the `type` of a Realtime event without parsing the whole message.
+
+    Returns None if the type cannot be located cheaply; callers should then
+    fall back to a full parse.
+    """
+    return _string_field(message, _TYPE_KEY, 0, _TYPE_SEARCH_LIMIT)
+
+
+def split_audio_delta(message):
+    """Return `(item_id, delta)` sliced from a raw `response.audio.delta` event.
+
+    The delta is returned untouched as the base64 string OpenAI sent. Returns
+    None if the message does not have the expected flat shape, in which case
+    the caller should parse it with `loads`.
+    """
+    delta = _string_field(message, _DELTA_KEY, max(message.rfind(_DELTA_KEY), 0))
+    if delta is None:
+        return None
+    item_id = _string_field(message, _ITEM_ID_KEY)
+    return item_id, delta
+
+
+def media_frame_prefix(stream_sid):
+    """Pre-build the part of a Twilio media frame that precedes the payload."""
+    return '{"event":"media","streamSid":%s,"media":{"payload":"' % dumps(stream_sid)
+
+
+def media_frame(prefix, payload):
+    """Complete a Twilio media frame from a prefix and a base64 payload."""
+    return prefix + payload + '"}}'
+
+
+def audio_append_message(payload):
+    """Build an `input_audio_buffer.append` event around a base64 payload."""
+    return '{"type":"input_audio_buffer.append","audio":"' + payload + '"}'
+
+
+class AudioCoalescer:
+    """Concatenate caller audio frames into fewer `input_audio_buffer.append` events.
+
+    Twilio sends one 20 ms frame per message; forwarding each one costs a
+    JSON event and a socket write. Frames are buffered until `window_ms` of
+    audio has accumulated and then flushed as a single base64 payload. A
+    window of 0 disables coalescing and passes payloads through untouched.
+    """
+
+    def __init__(self, window_ms, bytes_per_ms=8):
+        self.window_bytes = window_ms * bytes_per_ms
+        self._chunks = []
+        self._size = 0
+        self._first_received_at = None
+
+    def add(self, payload, received_at):
+        """Buffer one base64 frame; returns `(payload, received_at)` when a flush is due."""
+        if self.window_bytes <= 0:
+            return payload, received_at
+        return self.add_audio(base64.b64decode(payload), received_at)
+
+    def add_audio(self, audio, received_at):
+        """Like `add`, for audio that has already been decoded to bytes."""
+        if self.window_bytes <= 0:
+            return base64.b64encode(audio).decode('ascii'), received_at
+        if not self._chunks:
+            self._first_received_at = received_at
+        self._chunks.append(audio)
+        self._size += len(audio)
+        if self._size >= self.window_bytes:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Return everything buffered as `(payload, received_at)`, or None if empty.
+
+        `received_at` is when the oldest buffered frame arrived, so relay delay
+        metrics include the time spent waiting in the window.
+        """
+        if not self._chunks:
+            return None
+        payload = base64.b64encode(b''.join(self._chunks)).decode('ascii')
+        received_at = self._first_received_at
+        self._chunks.clear()
+        self._size = 0
+        return payload, received_at
+
+
+def decoded_size(payload):
+    """Raw byte count of a base64 payload, without decoding it."""
+    return len(payload) * 3 // 4 - payload.count('=', -2)
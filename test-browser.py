@@ -1,7 +1,13 @@
+import sys
 import asyncio
+import base64
 import websockets
 import json
 import requests
+import browser_transport
+
+# Run with `binary` as the first argument to test the binary transport
+TRANSPORT = sys.argv[1] if len(sys.argv) > 1 else browser_transport.JSON
 
 async def test_audio_stream():
     print("🧪 Starting WebSocket test")
@@ -15,12 +21,16 @@ async def test_audio_stream():
     test_data = response.json()
     print(f"📦 Got test audio data: {len(test_data['audio'])} bytes")
     
-    # Connect to browser stream
-    async with websockets.connect('ws://localhost/browser-stream') as ws:
-        print("🔌 Connected to WebSocket")
+    # Connect to browser stream; the test audio is 16 kHz PCM16
+    async with websockets.connect(f'ws://localhost/browser-stream?sample_rate=16000&transport={TRANSPORT}') as ws:
+        print(f"🔌 Connected to WebSocket ({TRANSPORT})")
         
         # Send test audio
-        await ws.send(json.dumps(test_data))
+        if TRANSPORT == browser_transport.BINARY:
+            print(f"🤝 Server confirmed: {await ws.recv()}")
+            await ws.send(browser_transport.audio_frame(base64.b64decode(test_data['audio']), 0))
+        else:
+            await ws.send(json.dumps(test_data))
         print("📤 Sent test audio")
         
         # Wait for response
@@ -0,0 +1,231 @@
+"""Function calling for the relay: a tool registry, an off-loop runner and a result cache.
+
+Tools are registered once per process on a `ToolRegistry`, either in
+code (`@registry.tool(...)`) or from the module named by TOOLS_MODULE,
+whose `register(registry)` adds them. `definitions()` is the `tools`
+list for `session.update`.
+
+During a call, a `ToolRunner` watches the Realtime events. Each
+`response.function_call_arguments.done` starts the tool right away,
+outside the relay loop: coroutine handlers run as their own task and
+plain functions run on the registry's thread pool, both limited to the
+tool's timeout, so audio keeps flowing while a tool works. Once the
+response that asked for the tools is done, their outputs go back as
+`function_call_output` items followed by one `response.create`. A tool
+that fails or times out returns `{"error": ...}` so the model can tell
+the caller. If that response was cancelled, or the caller starts
+speaking before the outputs are sent, the outputs still go back but the
+`response.create` does not: the caller interrupted that answer and
+server VAD starts the next one.
+
+Results are cached per process, keyed by tool and arguments (as
+canonical JSON), for the tool's `ttl` seconds; the least recently used
+entry is evicted beyond `cache_size`. The same question asked again, on
+any call, is answered from the cache, and concurrent calls with the same
+arguments share one run of the tool.
+"""
+import asyncio
+import importlib
+import inspect
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+TOOL_CALLS = metrics.Counter('relay_tool_calls_total',
+                             'Tool calls by tool and outcome (hit = answered from the cache).', ['tool', 'result'])
+TOOL_TIME = metrics.Histogram('relay_tool_seconds', 'Time to produce a tool result, cache hits included.', ['tool'])
+CACHE_ENTRIES = metrics.Gauge('relay_tool_cache_entries', 'Tool results held in the cache.')
+
+
+class Tool:
+    __slots__ = ('name', 'description', 'parameters', 'handler', 'timeout', 'ttl')
+
+    def __init__(self, name, description, parameters, handler, timeout, ttl):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.handler = handler
+        self.timeout = timeout
+        self.ttl = ttl
+
+
+class ResultCache:
+    """LRU cache of tool results with a per-entry expiry."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expiry, result)
+
+    def get(self, key, now=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= (time.monotonic() if now is None else now):
+            del self._entries[key]
+            CACHE_ENTRIES.set(len(self._entries))
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, result, ttl, now=None):
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries[key] = ((time.monotonic() if now is None else now) + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        CACHE_ENTRIES.set(len(self._entries))
+
+
+class ToolRegistry:
+    """The tools offered to every call, with their shared thread pool and result cache.
+
+    `timeout` and `ttl` are the defaults for tools that don't set their
+    own; a `ttl` of 0 leaves a tool's results uncached.
+    """
+
+    def __init__(self, timeout=5.0, ttl=300, cache_size=1024, threads=8):
+        self.timeout = timeout
+        self.ttl = ttl
+        self.tools = {}
+        self.cache = ResultCache(cache_size)
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='tool')
+        self._inflight = {}  # cache key -> future of the run in progress
+
+    def register(self, name, description, parameters, handler, timeout=None, ttl=None):
+        """Offer `handler(**arguments)` to the model as tool `name`.
+
+        `parameters` is the JSON schema of its arguments. The handler may be
+        a coroutine function or a plain (possibly blocking) function, and
+        returns anything JSON-serializable.
+        """
+        if name in self.tools:
+            raise ValueError(f"tool {name!r} is already registered")
+        if parameters.get('type') != 'object':
+            raise ValueError(f"parameters of tool {name!r} must be a JSON schema of type object")
+        self.tools[name] = Tool(name, description, parameters, handler,
+                                self.timeout if timeout is None else timeout, self.ttl if ttl is None else ttl)
+
+    def tool(self, name, description, parameters=None, timeout=None, ttl=None):
+        """Decorator form of `register`."""
+        def decorator(handler):
+            self.register(name, description, parameters or {"type": "object", "properties": {}}, handler,
+                          timeout, ttl)
+            return handler
+        return decorator
+
+    def load(self, module_name):
+        """Import `module_name` and let its `register(registry)` add tools."""
+        importlib.import_module(module_name).register(self)
+
+    def definitions(self):
+        """The `tools` list of `session.update`."""
+        return [{"type": "function", "name": tool.name, "description": tool.description,
+                 "parameters": tool.parameters} for tool in self.tools.values()]
+
+    async def call(self, name, arguments):
+        """Run tool `name` on JSON `arguments`; returns the JSON output for the model."""
+        started = time.perf_counter()
+        tool = self.tools.get(name)
+        if tool is None:
+            TOOL_CALLS.labels(name, 'unknown').inc()
+            return json.dumps({"error": f"unknown tool {name}"})
+        try:
+            kwargs = json.loads(arguments or '{}')
+        except ValueError:
+            TOOL_CALLS.labels(name, 'error').inc()
+            return json.dumps({"error": "arguments are not valid JSON"})
+        key = (name, json.dumps(kwargs, sort_keys=True, separators=(',', ':')))
+        output = self.cache.get(key)
+        if output is not None:
+            result = 'hit'
+        else:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = asyncio.ensure_future(self._run(tool, kwargs))
+                future.add_done_callback(lambda _: self._inflight.pop(key, None))
+                result = 'miss'
+            else:
+                result = 'shared'
+            output, failure = await asyncio.shield(future)
+            if failure:
+                result = failure
+            elif result == 'miss':
+                self.cache.put(key, output, tool.ttl)
+        TOOL_CALLS.labels(name, result).inc()
+        TOOL_TIME.labels(name).observe(time.perf_counter() - started)
+        return output
+
+    async def _run(self, tool, kwargs):
+        """Run the handler off the relay loop; returns (JSON output, None or 'timeout'/'error')."""
+        try:
+            if inspect.iscoroutinefunction(tool.handler):
+                value = await asyncio.wait_for(tool.handler(**kwargs), tool.timeout)
+            else:
+                loop = asyncio.get_running_loop()
+                value = await asyncio.wait_for(loop.run_in_executor(self.executor, lambda: tool.handler(**kwargs)),
+                                               tool.timeout)
+            return json.dumps(value), None
+        except asyncio.TimeoutError:
+            return json.dumps({"error": f"{tool.name} timed out after {tool.timeout}s"}), 'timeout'
+        except Exception as e:
+            return json.dumps({"error": f"{tool.name} failed: {e}"}), 'error'
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ToolRunner:
+    """Answers one call's function calls through `send` (which queues an event for OpenAI)."""
+
+    def __init__(self, registry, send, call_log):
+        self.registry = registry
+        self.send = send
+        self.call_log = call_log
+        self._pending = {}  # call id -> task producing its output, for the response in progress
+        self._replies = {}  # task sending outputs -> id of the response that asked for them
+        self._cancelled = set()  # ids of those responses that must not be followed by response.create
+
+    def observe(self, event):
+        """Start tools requested in parsed server event `event`; reply once their response is done."""
+        kind = event['type']
+        if kind == 'response.function_call_arguments.done':
+            # Arguments may carry what the caller said, so they are only logged at debug level
+            self.call_log.info('tool.call', "Calling %s (call %s)", event['name'], event['call_id'])
+            self.call_log.debug('tool.arguments', "Arguments of call %s: %s", event['call_id'], event['arguments'])
+            self._pending[event['call_id']] = asyncio.ensure_future(
+                self.registry.call(event['name'], event['arguments']))
+        elif kind == 'response.done' and self._pending:
+            pending, self._pending = self._pending, {}
+            response = event['response']
+            if response.get('status') == 'cancelled':
+                self._cancelled.add(response.get('id'))
+            reply = asyncio.ensure_future(self._reply(response.get('id'), pending))
+            self._replies[reply] = response.get('id')
+            reply.add_done_callback(lambda task: self._replies.pop(task, None))
+        elif kind == 'input_audio_buffer.speech_started':
+            self._cancelled.update(self._replies.values())
+
+    async def _reply(self, response_id, pending):
+        for call_id, task in pending.items():
+            output = await task
+            self.send(json.dumps({
+                "type": "conversation.item.create",
+                "item": {"type": "function_call_output", "call_id": call_id, "output": output},
+            }))
+        if response_id in self._cancelled:
+            self._cancelled.discard(response_id)
+            self.call_log.info('tool.interrupted', "Not answering tool results of interrupted response %s",
+                               response_id)
+        else:
+            self.send(json.dumps({"type": "response.create"}))
+
+    def cancel(self):
+        """Drop tool calls in progress, e.g. when the session they belong to is gone."""
+        for task in list(self._pending.values()) + list(self._replies):
+            task.cancel()
+        self._pending = {}
+        self._cancelled.clear()
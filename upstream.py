@@ -0,0 +1,270 @@
+"""OpenAI Realtime session that survives its WebSocket dropping mid-call.
+
+`ResilientSession` stands in for the Realtime WebSocket in the relay
+handlers: it has the same `send()` and async iteration. If the connection
+fails, both sides wait while it takes a session from the pool (usually
+an already warm one) and replays onto it:
+
+* every `session.update` sent through it, in order, since later ones
+  may change only part of the session (pooled sessions are already
+  configured for Twilio);
+* a compact copy of the conversation: the text of the last `max_items`
+  messages, taken from text items and audio transcripts, under their
+  original item ids;
+* the caller audio sent since the server last committed its input
+  buffer, up to `replay_ms`, so speech cut off by the failure is heard;
+* `response.create` if a response was being generated.
+
+Caller audio that arrives meanwhile waits in the relay's inbound queue,
+which is bounded, and is flushed once the new session is in place. If no
+session can be set up within `budget` seconds, `ResumeFailed` ends the
+call as a plain disconnect would have.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+import websockets
+
+import metrics
+import relay
+
+RECONNECTS = metrics.Counter('relay_upstream_reconnects_total',
+                             'OpenAI connections lost mid-call, by whether the session was resumed.',
+                             ['transport', 'result'])
+RECOVERY_TIME = metrics.Histogram('relay_upstream_recovery_seconds',
+                                  'OpenAI connection lost to resumed session ready.', ['transport'])
+LOST_AUDIO = metrics.Counter('relay_upstream_lost_audio_seconds_total',
+                             'Caller speech sent to a failed OpenAI connection and not replayed.', ['transport'])
+
+_APPEND_OVERHEAD = len(relay.audio_append_message(''))
+# Events that change the copy of the conversation kept for replay
+_TRACKED = frozenset((
+    'conversation.item.created', 'conversation.item.deleted',
+    'conversation.item.input_audio_transcription.completed', 'response.audio_transcript.done',
+    'input_audio_buffer.speech_started', 'input_audio_buffer.committed', 'input_audio_buffer.cleared',
+    'response.created', 'response.done',
+))
+# Content part types that carry text, by role, for replayed items
+_TEXT_PART = {'user': 'input_text', 'assistant': 'text', 'system': 'input_text'}
+
+
+def item_text(item):
+    """The text of a message item, or the transcript of its audio if it has one yet."""
+    for part in item.get('content') or ():
+        text = part.get('text') or part.get('transcript')
+        if text:
+            return text
+    return None
+
+
+class ResumeFailed(Exception):
+    """No new OpenAI session could be set up within the recovery budget."""
+
+
+class ResilientSession:
+    """A pooled Realtime session that is transparently replaced if its connection fails.
+
+    `bytes_per_ms` is the raw size of a millisecond of the session's input
+    audio. `on_resume` is called once a new session is in place, so the
+    handler can forget item ids and responses that died with the old one.
+    """
+
+    def __init__(self, pool, call_log, budget=5.0, max_items=20, replay_ms=5000, bytes_per_ms=8,
+                 on_resume=None):
+        self.pool = pool
+        self.call_log = call_log
+        self.budget = budget
+        self.max_items = max_items
+        self.replay_bytes = replay_ms * bytes_per_ms
+        self.bytes_per_ms = bytes_per_ms
+        self.on_resume = on_resume
+        self.ws = None
+        self.reconnects = 0
+        self._closing = False
+        self._recovery = None
+        self._session_updates = []
+        self._items = {}  # item id -> [role, text], in conversation order
+        # (input_audio_buffer.append message, raw audio size) since the last commit
+        self._uncommitted = deque()
+        self._uncommitted_bytes = 0
+        self._evicted_speech = 0
+        self._speaking = False
+        self._responding = False
+        self._resumed = RECONNECTS.labels(call_log.transport, 'resumed')
+        self._failed = RECONNECTS.labels(call_log.transport, 'failed')
+        self._recovery_time = RECOVERY_TIME.labels(call_log.transport)
+        self._lost_audio = LOST_AUDIO.labels(call_log.transport)
+
+    async def __aenter__(self):
+        self.ws = await self.pool.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        self._closing = True
+        if self._recovery is not None:
+            self._recovery.cancel()
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def send(self, message):
+        """Send on the current connection, waiting out a reconnect if it fails."""
+        while True:
+            ws = self.ws
+            try:
+                await ws.send(message)
+                break
+            except websockets.ConnectionClosed:
+                await self._recover(ws)
+        self._sent(message)
+
+    async def __aiter__(self):
+        while True:
+            ws = self.ws
+            try:
+                async for message in ws:
+                    if self._closing:
+                        return
+                    self._received(message)
+                    yield message
+            except websockets.ConnectionClosedError:
+                pass
+            if self._closing:
+                return
+            # The server closed the connection, cleanly or not, in the middle of the call
+            await self._recover(ws)
+
+    def _sent(self, message):
+        kind = relay.event_type(message)
+        if kind == 'input_audio_buffer.append':
+            size = (len(message) - _APPEND_OVERHEAD) * 3 // 4
+            self._uncommitted.append((message, size))
+            self._uncommitted_bytes += size
+            while self._uncommitted_bytes > self.replay_bytes and len(self._uncommitted) > 1:
+                _, size = self._uncommitted.popleft()
+                self._uncommitted_bytes -= size
+                if self._speaking:
+                    self._evicted_speech += size
+        elif kind == 'session.update':
+            self._session_updates.append(message)
+
+    def _received(self, message):
+        kind = relay.event_type(message)
+        if kind == relay.AUDIO_DELTA or (kind is not None and kind not in _TRACKED):
+            return
+        event = relay.loads(message)
+        kind = event.get('type')
+        if kind == 'conversation.item.created':
+            item = event['item']
+            role = item.get('role')
+            if item.get('type') == 'message' and role in _TEXT_PART and item['id'] not in self._items:
+                self._insert(item['id'], [role, item_text(item)], event.get('previous_item_id'))
+        elif kind == 'conversation.item.deleted':
+            self._items.pop(event['item_id'], None)
+        elif kind in ('conversation.item.input_audio_transcription.completed', 'response.audio_transcript.done'):
+            item = self._items.get(event.get('item_id'))
+            if item is not None:
+                item[1] = event['transcript']
+        elif kind == 'input_audio_buffer.speech_started':
+            self._speaking = True
+        elif kind in ('input_audio_buffer.committed', 'input_audio_buffer.cleared'):
+            self._speaking = False
+            self._uncommitted.clear()
+            self._uncommitted_bytes = 0
+            self._evicted_speech = 0
+        elif kind == 'response.created':
+            self._responding = True
+        elif kind == 'response.done':
+            self._responding = False
+
+    def _insert(self, item_id, entry, previous_item_id):
+        """Add an item where the server put it: after `previous_item_id`, or first."""
+        if self._items and previous_item_id == next(reversed(self._items)):
+            self._items[item_id] = entry
+            return
+        items = list(self._items.items())
+        position = next((i + 1 for i, (key, _) in enumerate(items) if key == previous_item_id),
+                        0 if previous_item_id in (None, 'root') else len(items))
+        items.insert(position, (item_id, entry))
+        self._items = dict(items)
+
+    async def _recover(self, failed_ws):
+        """Replace `failed_ws`; concurrent callers share one recovery."""
+        if self.ws is not failed_ws:
+            return
+        if self._closing:
+            raise ResumeFailed("session closed")
+        if self._recovery is None:
+            self._recovery = asyncio.ensure_future(self._reconnect(failed_ws))
+            self._recovery.add_done_callback(self._recovered)
+        await asyncio.shield(self._recovery)
+
+    def _recovered(self, task):
+        self._recovery = None
+
+    async def _reconnect(self, failed_ws):
+        lost_at = time.perf_counter()
+        deadline = lost_at + self.budget
+        self.call_log.warning('upstream.lost', "OpenAI connection lost (code %s), resuming session",
+                              failed_ws.close_code)
+        asyncio.ensure_future(failed_ws.close())
+        attempts = 0
+        while True:
+            attempts += 1
+            remaining = deadline - time.perf_counter()
+            ws = None
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                ws = await asyncio.wait_for(self.pool.acquire(), remaining)
+                await asyncio.wait_for(self._replay(ws), deadline - time.perf_counter())
+                break
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                if ws is not None:
+                    asyncio.ensure_future(ws.close())
+                if time.perf_counter() + 0.1 >= deadline:
+                    self._failed.inc()
+                    self.call_log.error('upstream.resume_failed', "Could not resume the OpenAI session "
+                                        "within %.1fs after %d attempts: %r", self.budget, attempts, e)
+                    raise ResumeFailed(f"no OpenAI session within {self.budget}s") from e
+                await asyncio.sleep(0.1)
+
+        recovery_time = time.perf_counter() - lost_at
+        lost_ms = self._evicted_speech / self.bytes_per_ms
+        self.ws = ws
+        self.reconnects += 1
+        self._resumed.inc()
+        self._recovery_time.observe(recovery_time)
+        self._lost_audio.inc(lost_ms / 1000)
+        self._evicted_speech = 0
+        self.call_log.info('upstream.resumed', "Resumed OpenAI session in %.0fms (attempt %d, %d items, "
+                           "%.0fms caller audio replayed, %.0fms caller speech lost)",
+                           recovery_time * 1000, attempts, min(len(self._items), self.max_items),
+                           self._uncommitted_bytes / self.bytes_per_ms, lost_ms)
+        if self.on_resume is not None:
+            self.on_resume()
+
+    async def _replay(self, ws):
+        """Bring a fresh session up to where the failed one was."""
+        for message in self._session_updates:
+            await ws.send(message)
+        items = [(item_id, role, text) for item_id, (role, text) in self._items.items() if text]
+        for item_id, role, text in items[-self.max_items:]:
+            await ws.send(json.dumps({
+                "type": "conversation.item.create",
+                "item": {
+                    "id": item_id,
+                    "type": "message",
+                    "role": role,
+                    "content": [{"type": _TEXT_PART[role], "text": text}],
+                },
+            }))
+        for message, _ in self._uncommitted:
+            await ws.send(message)
+        if self._responding and not self._speaking:
+            # The answer being generated died with the old session; ask for it again
+            await ws.send(json.dumps({"type": "response.create"}))
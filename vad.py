@@ -0,0 +1,88 @@
+"""Local voice-activity gate for caller audio.
+
+Long stretches of line silence and callers on hold still cost
+upstream bandwidth and billed input audio. `VoiceGate` drops audio that
+is clearly silent before it is appended to the OpenAI input buffer.
+
+Each chunk is split into short frames and classified with a vectorized
+energy and zero-crossing test (mu-law is decoded through the lookup
+table in audio_codec.py): loud frames are speech, and quieter
+frames with a high zero-crossing rate (unvoiced consonants like "s" and
+"f") count as speech too. A hangover keeps forwarding audio for a while
+after speech ends, longer than server_vad's silence window, so OpenAI
+still sees the trailing silence it needs to emit `speech_stopped`. A
+pre-roll buffer replays the audio just before speech onset so the
+start of the first word is not clipped.
+"""
+from collections import deque
+
+import numpy as np
+
+import audio_codec
+
+
+class VoiceGate:
+    """Drop clearly silent caller audio, keeping hangover and pre-roll around speech.
+
+    `process()` takes one raw chunk and returns the bytes to forward (which
+    may include buffered pre-roll) or b'' if the chunk was suppressed.
+    Audio only counts towards `suppressed_bytes` once it has fallen out of
+    the pre-roll buffer, so the counter never goes backwards.
+    """
+
+    def __init__(self, audio_format='g711_ulaw', threshold_db=-45.0, frame_ms=20,
+                 hangover_ms=800, preroll_ms=300, fricative_zcr=0.35):
+        self.encoding, rate = audio_codec.FORMATS[audio_format]
+        samples_per_ms = rate // 1000
+        self.bytes_per_ms = samples_per_ms * audio_codec.BYTES_PER_SAMPLE[self.encoding]
+        self.frame_samples = samples_per_ms * frame_ms
+        self.threshold_db = threshold_db
+        self.fricative_zcr = fricative_zcr
+        self.hangover_ms = hangover_ms
+        self.preroll_bytes = preroll_ms * self.bytes_per_ms
+        self._preroll = deque()
+        self._preroll_size = 0
+        self._hangover_left = 0
+        self.forwarded_bytes = 0
+        self.suppressed_bytes = 0
+
+    def is_speech(self, audio):
+        """Classify a raw chunk; True if any of its frames looks like speech."""
+        samples = audio_codec.decode(audio, self.encoding).astype(np.float32)
+        if samples.size == 0:
+            return False
+        frames = -(-samples.size // self.frame_samples)
+        samples = np.pad(samples, (0, frames * self.frame_samples - samples.size))
+        samples = samples.reshape(frames, self.frame_samples)
+        rms = np.sqrt(np.mean(samples * samples, axis=1)) + 1e-9
+        level_db = 20 * np.log10(rms / 32768)
+        signs = np.signbit(samples)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        active = (level_db > self.threshold_db) | (
+            (level_db > self.threshold_db - 10) & (zcr > self.fricative_zcr))
+        return bool(active.any())
+
+    def process(self, audio):
+        """Return the audio to forward for this chunk, or b'' if it is suppressed."""
+        if self.is_speech(audio):
+            self._hangover_left = self.hangover_ms
+            if self._preroll:
+                self._preroll.append(audio)
+                audio = b''.join(self._preroll)
+                self._preroll.clear()
+                self._preroll_size = 0
+        elif self._hangover_left > 0:
+            self._hangover_left -= len(audio) / self.bytes_per_ms
+        else:
+            self._buffer_preroll(audio)
+            return b''
+        self.forwarded_bytes += len(audio)
+        return audio
+
+    def _buffer_preroll(self, audio):
+        self._preroll.append(audio)
+        self._preroll_size += len(audio)
+        while self._preroll_size - len(self._preroll[0]) >= self.preroll_bytes:
+            dropped = len(self._preroll.popleft())
+            self._preroll_size -= dropped
+            self.suppressed_bytes += dropped
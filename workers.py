@@ -0,0 +1,208 @@
+"""Multi-process serving: one supervisor, several relay worker processes.
+
+One event loop runs every call's JSON and base64 work on a single core.
+With WORKERS=N, `python main.py` starts a supervisor that runs N copies
+of the server on PORT, PORT+1, ... PORT+N-1, each with its own event
+loop, realtime pool and ADMISSION_MAX_CALLS cap.
+
+Workers publish their health once a second as `worker-<index>.json` in
+a shared directory (`Cluster.report`). Any worker can answer
+`/incoming-call`: it reads the others' reports, picks the one with the
+most free slots (`Cluster.pick`) and points the call's media stream at
+it. A call sent to a worker counts against that worker, in every
+worker's view, from then until its stream starts there (or
+`RESERVATION_TTL` passes), so a burst of calls answered by different
+workers is not all sent to the same one.
+
+Callers on hold are shared the same way. Each report lists the worker's
+callers on hold, keyed by Twilio's CallSid, with the time each was
+first held (`Cluster.hold_queue`). A hold redirect that lands on another
+worker therefore finds the caller's place in line, and a free slot goes
+to the caller who has waited longest on any worker.
+
+Stopping the supervisor (SIGTERM or Ctrl-C) drains the workers first.
+Each worker gets SIGUSR1, after which no new calls are sent to it, and
+is stopped once its live calls and the calls already on their way to it
+have ended, or `drain_timeout` has passed. SIGUSR1 sent to a single
+worker, or to a single-process server, drains just that process.
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import eventlog
+from admission import RESERVATION_TTL
+
+# A worker whose report is older than this many seconds is considered gone.
+STALE_AFTER = 3
+
+
+class Cluster:
+    """This worker's view of the workers sharing its report `directory`."""
+
+    def __init__(self, directory, index, port):
+        self.directory = directory
+        self.index = index
+        self.port = port
+        self._placed = {}   # call id -> (worker index, expiry) for calls this worker sent somewhere
+        self._started = {}  # call id -> expiry for calls whose stream started here
+        self._reports = None
+        self._read_at = 0.0
+
+    def report(self, active, max_calls, draining, waiting=None):
+        """Publish this worker's health; written atomically so readers never see half a report.
+
+        `waiting` maps this worker's callers on hold to when they were first held.
+        """
+        now = time.time()
+        self._expire(now)
+        health = {
+            'index': self.index, 'pid': os.getpid(), 'port': self.port, 'active': active,
+            'max_calls': max_calls, 'draining': draining, 'updated': now,
+            'placed': {call_id: index for call_id, (index, _) in self._placed.items()},
+            'started': list(self._started),
+            'waiting': waiting or {},
+        }
+        path = report_path(self.directory, self.index)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(health, f)
+        os.replace(path + '.tmp', path)
+        return health
+
+    def workers(self):
+        """Current reports of every live worker, re-read at most every 0.2 s."""
+        now = time.time()
+        if self._reports is None or now - self._read_at > 0.2:
+            self._reports = read_reports(self.directory)
+            self._read_at = now
+        return self._reports
+
+    def pick(self):
+        """The report of the worker with the most free slots, or None if all are full or draining."""
+        now = time.time()
+        self._expire(now)
+        reports = self.workers()
+        own = {call_id: index for call_id, (index, _) in self._placed.items()}
+        best, best_free, best_used = None, 0, float('inf')
+        for worker in reports:
+            if worker['draining']:
+                continue
+            used = worker['active'] + pending(reports, worker['index'], own)
+            free = worker['max_calls'] - used if worker['max_calls'] else float('inf')
+            # Among uncapped workers the least loaded wins
+            if free > best_free or (free == best_free and best is not None and used < best_used):
+                best, best_free, best_used = worker, free, used
+        return best
+
+    def hold_queue(self):
+        """Callers on hold at the other workers, and the calls any worker has since admitted.
+
+        Returns `(held, settled)`: call id -> when it was first held, and a
+        set of call ids that are no longer waiting anywhere.
+        """
+        reports = self.workers()
+        settled = set(self._placed)
+        for report in reports:
+            settled.update(report['placed'])
+        held = {}
+        for report in reports:
+            if report['index'] == self.index:
+                continue
+            for call_id, first_seen in report.get('waiting', {}).items():
+                if call_id not in settled:
+                    held[call_id] = min(held.get(call_id, first_seen), first_seen)
+        return held, settled
+
+    def placed(self, worker, call_id):
+        """Call `call_id` was just sent to `worker`."""
+        self._placed[call_id] = (worker['index'], time.time() + RESERVATION_TTL)
+
+    def stream_started(self, call_id):
+        """The stream of call `call_id` connected to this worker; it now counts in `active`."""
+        self._started[call_id] = time.time() + RESERVATION_TTL
+
+    def _expire(self, now):
+        self._placed = {c: placement for c, placement in self._placed.items() if placement[1] > now}
+        self._started = {c: expires for c, expires in self._started.items() if expires > now}
+
+
+def report_path(directory, index):
+    return os.path.join(directory, f'worker-{index}.json')
+
+
+def read_reports(directory):
+    """Reports of the workers in `directory` that are still reporting."""
+    now = time.time()
+    reports = []
+    for name in os.listdir(directory):
+        if name.startswith('worker-') and name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    report = json.load(f)
+            except (OSError, ValueError):
+                continue  # replaced or removed while listing
+            if now - report['updated'] < STALE_AFTER:
+                reports.append(report)
+    return reports
+
+
+def pending(reports, index, own=None):
+    """Calls sent to worker `index` by any worker whose stream has not started there yet."""
+    calls = dict(own or {})
+    started = set()
+    for report in reports:
+        calls.update(report['placed'])
+        if report['index'] == index:
+            started.update(report['started'])
+    return sum(1 for call_id, target in calls.items() if target == index and call_id not in started)
+
+
+def supervise(count, port, directory, drain_timeout=3600):
+    """Run `count` main.py workers on consecutive ports until stopped, then drain them."""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.startswith('worker-'):
+            os.remove(os.path.join(directory, name))
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+
+    def spawn(index):
+        env = dict(os.environ, PORT=str(port + index), WORKER_INDEX=str(index), WORKER_HEALTH_DIR=directory)
+        # In their own session, so Ctrl-C reaches only the supervisor and the workers can drain
+        return subprocess.Popen([sys.executable, main], env=env, start_new_session=True)
+
+    eventlog.setup()
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    workers = [spawn(index) for index in range(count)]
+    eventlog.info('supervisor.started', "Supervisor %d started %d workers on ports %d-%d",
+                  os.getpid(), count, port, port + count - 1)
+    while not stopping:
+        time.sleep(0.5)
+        for index, worker in enumerate(workers):
+            if worker.poll() is not None and not stopping:
+                eventlog.error('supervisor.worker_exited', "Worker %d exited with code %d, restarting",
+                               index, worker.returncode)
+                workers[index] = spawn(index)
+
+    eventlog.info('supervisor.draining', "Draining workers")
+    for worker in workers:
+        if worker.poll() is None:
+            worker.send_signal(signal.SIGUSR1)
+    deadline = time.monotonic() + drain_timeout
+    # A second Ctrl-C stops the workers without waiting
+    while time.monotonic() < deadline and len(stopping) < 2:
+        time.sleep(0.5)
+        reports = read_reports(directory)
+        if not any(report['active'] or pending(reports, report['index']) for report in reports):
+            break
+    for worker in workers:
+        if worker.poll() is None:
+            worker.terminate()
+    for worker in workers:
+        worker.wait()
+    eventlog.info('supervisor.stopped', "Workers stopped")
+    eventlog.shutdown()